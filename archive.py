@@ -0,0 +1,91 @@
+"""Persistent on-disk store of FPL API documents for finished gameweeks."""
+
+import json
+import os
+import sqlite3
+from threading import Lock
+
+
+ARCHIVE_PATH = os.environ.get('FPL_ARCHIVE_PATH', 'fpl_archive.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS season_documents (
+    season INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    manager_id INTEGER NOT NULL,
+    gameweek INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (season, kind, manager_id, gameweek)
+)
+"""
+
+
+class GameweekArchive:
+    """Stores raw API documents in SQLite, keyed by manager and gameweek.
+
+    Only documents for gameweeks that are finished and data checked should be
+    saved, since those never change again. Documents which don't belong to a
+    manager, such as live points, are saved under manager ID 0. FPL reuses
+    manager IDs and gameweek numbers every season, so each document is also
+    keyed by the season it belongs to.
+    """
+
+    def __init__(self, path: str = ARCHIVE_PATH) -> None:
+        self.path = path
+        self._lock = Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the database, creating the table if it doesn't exist."""
+
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(SCHEMA)
+        return self._conn
+
+    def load_many(self, season: int, kind: str,
+                  keys: list[tuple[int, int]]) -> dict:
+        """Returns a season's saved documents for (manager ID, gameweek) keys."""
+
+        if not keys:
+            return {}
+
+        with self._lock:
+            conn = self._connect()
+            rows = []
+            for manager_id, gameweek in keys:
+                rows += conn.execute(
+                    'SELECT manager_id, gameweek, payload FROM season_documents '
+                    'WHERE season = ? AND kind = ? AND manager_id = ? '
+                    'AND gameweek = ?',
+                    (season, kind, manager_id, gameweek)).fetchall()
+
+        return {(manager_id, gameweek): json.loads(payload)
+                for manager_id, gameweek, payload in rows}
+
+    def save_many(self, season: int, kind: str, documents: dict) -> None:
+        """Saves a season's documents keyed by (manager ID, gameweek)."""
+
+        if not documents:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO season_documents '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(season, kind, manager_id, gameweek, json.dumps(document))
+                     for (manager_id, gameweek), document in documents.items()])
+
+    def close(self) -> None:
+        """Closes the database connection."""
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+ARCHIVE = GameweekArchive()
@@ -0,0 +1,237 @@
+"""Benchmarks the extract functions against the mock FPL API.
+
+Each public extract function is run cold, with every cache emptied, for
+synthetic leagues of each size at each gameweek. The wall time, number of
+HTTP requests, peak traced memory and allocated blocks are compared with
+the baselines in benchmark_baselines.json, and any function which goes over
+its tolerance fails the run. Record new baselines with --update.
+
+Memory is measured with tracemalloc in a separate run, so it covers Python
+allocations but not the memory polars allocates natively.
+"""
+
+import argparse
+from contextlib import contextmanager
+import json
+import sys
+import tempfile
+from threading import Thread
+import time
+import tracemalloc
+
+import extract
+from fetch import TokenBucket
+from mock_api import MockFPLServer, SyntheticLeague
+from spill import ParquetSpill
+
+
+# The largest league is one manager over the out-of-core threshold, so the
+# spilled path has a baseline too.
+MANAGER_COUNTS = (5, 20, 50, extract.OUT_OF_CORE_MANAGERS + 1)
+GAMEWEEK_COUNTS = (5, 20, 38)
+BASELINES_PATH = 'benchmark_baselines.json'
+
+# How far over its baseline each measurement can go before the run fails,
+# as a share of the baseline plus a fixed slack so tiny baselines aren't
+# failed by noise.
+TOLERANCES = {'requests': 0.1, 'seconds': 1.0, 'peak_bytes': 0.5}
+SLACK = {'requests': 0, 'seconds': 0.05, 'peak_bytes': 256 * 1024}
+
+LEAGUE_CODE = 1
+
+# Requests per second allowed by the shared engine, high enough that the
+# benchmarks measure the code rather than the rate limit.
+UNLIMITED_RATE = 1e6
+
+LEAGUE_FUNCTIONS = ('get_raw_league_data', 'get_rankings')
+
+MANAGER_FUNCTIONS = ('get_season_league_rankings', 'get_league_captain_picks',
+                     'get_points_progression_data', 'get_points_average_data',
+                     'get_league_chip_data', 'get_overall_rankings_data')
+
+FUNCTIONS = LEAGUE_FUNCTIONS + MANAGER_FUNCTIONS
+
+URLS = {'FPL_INFO_URL': '/bootstrap-static/',
+        'LEAGUE_BASE_URL': '/leagues-classic',
+        'MANAGER_BASE_URL': '/entry',
+        'GAMEWEEK_BASE_URL': '/event',
+        'FIXTURES_URL': '/fixtures/'}
+
+STORES = (extract.PICKS_STORE, extract.LIVE_POINTS_STORE, extract.HISTORY_STORE)
+
+
+@contextmanager
+def patch_api(base_url: str, rate: float | None = UNLIMITED_RATE):
+    """Points the extract functions at an FPL API served from base_url.
+
+    The shared fetch engine is limited to rate requests per second, or keeps
+    its own limit if rate is None, and nothing is archived or spilled outside
+    a temporary directory while the block runs.
+    """
+
+    saved = {name: getattr(extract, name) for name in (*URLS, 'SPILL')}
+    bucket = extract.ENGINE.bucket
+    archives = [store._archive for store in STORES]  # pylint: disable=protected-access
+
+    with tempfile.TemporaryDirectory() as spill_path:
+        for name, path in URLS.items():
+            setattr(extract, name, f"{base_url}{path}")
+        extract.SPILL = ParquetSpill(spill_path)
+        if rate is not None:
+            extract.ENGINE.bucket = TokenBucket(rate, extract.ENGINE.max_concurrency)
+        for store in STORES:
+            store._archive = None  # pylint: disable=protected-access
+
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(extract, name, value)
+            extract.ENGINE.bucket = bucket
+            for store, archive in zip(STORES, archives):
+                store._archive = archive  # pylint: disable=protected-access
+
+
+@contextmanager
+def mock_api(managers: int, gameweeks: int, latency: float = 0.0,
+             rate: float | None = UNLIMITED_RATE):
+    """Serves a synthetic league from a mock API and points the extract functions at it."""
+
+    server = MockFPLServer(SyntheticLeague(managers, gameweeks), latency=latency)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    try:
+        with patch_api(server.base_url, rate):
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def call_function(name: str, league_data: dict, manager_data):
+    """Calls an extract function with the arguments it takes."""
+
+    if name == 'get_raw_league_data':
+        return extract.get_raw_league_data(LEAGUE_CODE)
+    if name == 'get_rankings':
+        return extract.get_rankings(league_data)
+    return getattr(extract, name)(manager_data)
+
+
+def clear_caches() -> None:
+    """Empties every cache so the next call starts cold."""
+
+    for store in STORES:
+        store.clear()
+    extract.BOOTSTRAP_CACHE.clear()
+    extract.SPILL.clear()
+
+
+def measure(call, server: MockFPLServer) -> dict:
+    """Returns the wall time, requests and memory used by a cold call."""
+
+    clear_caches()
+    requests = server.requests
+    start = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - start
+    requests = server.requests - requests
+
+    clear_caches()
+    tracemalloc.start()
+    call()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in
+                 tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return {'seconds': round(seconds, 4), 'requests': requests,
+            'peak_bytes': peak_bytes, 'allocated_blocks': blocks}
+
+
+def run_benchmarks(manager_counts=MANAGER_COUNTS, gameweek_counts=GAMEWEEK_COUNTS,
+                   functions=FUNCTIONS) -> dict[str, dict]:
+    """Returns the measurements for every function, league size and gameweek."""
+
+    results = {}
+
+    for managers in manager_counts:
+        for gameweeks in gameweek_counts:
+            with mock_api(managers, gameweeks) as server:
+                league_data = extract.get_raw_league_data(LEAGUE_CODE)
+                manager_data = extract.get_manager_data(league_data)
+
+                for name in functions:
+                    results[f"{name}[{managers}x{gameweeks}]"] = measure(
+                        lambda name=name, league_data=league_data, manager_data=manager_data:
+                        call_function(name, league_data, manager_data),
+                        server)
+
+    return results
+
+
+def compare(results: dict, baselines: dict) -> list[str]:
+    """Returns a description of every measurement which is over its baseline."""
+
+    regressions = []
+
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+        for measurement, tolerance in TOLERANCES.items():
+            limit = baseline[measurement] * (1 + tolerance) + SLACK[measurement]
+            if result[measurement] > limit:
+                regressions.append(
+                    f"{key}: {measurement} {result[measurement]} is over "
+                    f"{limit:g} (baseline {baseline[measurement]})")
+
+    return regressions
+
+
+def main() -> None:
+    """Runs the benchmarks, then checks or updates the baselines."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--managers', type=int, nargs='+', default=MANAGER_COUNTS)
+    parser.add_argument('--gameweeks', type=int, nargs='+', default=GAMEWEEK_COUNTS)
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS,
+                        choices=FUNCTIONS)
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--update', action='store_true',
+                        help='Save the results as the new baselines.')
+    args = parser.parse_args()
+
+    try:
+        results = run_benchmarks(args.managers, args.gameweeks, args.functions)
+    finally:
+        extract.ENGINE.close()
+
+    print(f"{'benchmark':<45} {'seconds':>9} {'requests':>9} "
+          f"{'peak bytes':>12} {'blocks':>9}")
+    for key, result in results.items():
+        print(f"{key:<45} {result['seconds']:>9.3f} {result['requests']:>9} "
+              f"{result['peak_bytes']:>12} {result['allocated_blocks']:>9}")
+
+    try:
+        with open(args.baselines, encoding='utf-8') as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        baselines = {}
+
+    if args.update:
+        with open(args.baselines, 'w', encoding='utf-8') as file:
+            json.dump({**baselines, **results}, file, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+        return
+
+    regressions = compare(results, baselines)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
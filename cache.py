@@ -0,0 +1,204 @@
+"""Process-wide cache of analytics shared by every dashboard session."""
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+import json
+import logging
+import sys
+from threading import Lock
+import time
+
+import polars as pl
+
+
+MAX_CACHE_BYTES = 256 * 1024 ** 2
+
+# Threads refreshing stale entries in the background.
+REVALIDATE_WORKERS = 4
+
+
+def get_size(value) -> int:
+    """Returns the approximate memory used by a cached value in bytes.
+
+    Frames, and objects holding frames, report their own size. Raw API
+    documents are measured by the length of their JSON, since the shallow
+    size of a dict leaves out everything it holds.
+    """
+
+    if hasattr(value, 'estimated_size'):
+        return value.estimated_size()
+    if isinstance(value, (dict, list)):
+        return len(json.dumps(value))
+    return sys.getsizeof(value)
+
+
+class AnalyticsCache:
+    """Least-recently-used cache of computed analytics with a memory limit.
+
+    Concurrent requests for the same key are coalesced, so each key is
+    computed once however many sessions ask for it at the same time.
+
+    Expired entries are kept until they are evicted, so they can be served
+    stale while they are recomputed in the background.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES, clock=time.time) -> None:
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+        self._executor = ThreadPoolExecutor(REVALIDATE_WORKERS,
+                                            thread_name_prefix='revalidate')
+
+    def _lookup(self, key: tuple, stale: bool = False):
+        """Returns a cached entry for a key, or None if there isn't one.
+
+        Expired entries are only returned if stale ones are wanted.
+        """
+
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        if not stale and entry['expires_at'] <= self._clock():
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: tuple) -> None:
+        """Removes an entry and releases its memory allowance."""
+
+        entry = self._entries.pop(key)
+        self.size -= entry['size']
+
+    def _store(self, key: tuple, value, ttl: float | None) -> None:
+        """Adds an entry, evicting the least recently used ones to fit it."""
+
+        size = get_size(value)
+
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        while self._entries and self.size + size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+        self._entries[key] = {
+            'value': value, 'size': size, 'created_at': self._clock(),
+            'expires_at': float('inf') if ttl is None else self._clock() + ttl}
+        self.size += size
+
+    def get_or_compute(self, key: tuple, compute, ttl: float | None = None):
+        """Returns the cached value for a key, computing it if needed.
+
+        If another thread is already computing the same key, this waits for
+        its result instead of computing it again.
+        """
+
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry['value']
+
+            flight = self._in_flight.get(key)
+            owner = flight is None
+            if owner:
+                flight = Future()
+                self._in_flight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return flight.result()
+
+        return self._compute(key, compute, ttl, flight)
+
+    def _compute(self, key: tuple, compute, ttl: float | None, flight: Future):
+        """Computes and stores the value for a key, settling its in-flight future."""
+
+        try:
+            value = compute()
+        except Exception as err:
+            with self._lock:
+                del self._in_flight[key]
+            flight.set_exception(err)
+            raise
+
+        with self._lock:
+            self._store(key, value, ttl)
+            del self._in_flight[key]
+        flight.set_result(value)
+
+        return value
+
+    def _revalidate(self, key: tuple, compute, ttl: float | None, flight: Future) -> None:
+        """Recomputes a stale entry, keeping the stale value if it fails."""
+
+        try:
+            self._compute(key, compute, ttl, flight)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            logging.warning(f'Could not refresh {key[0]}: {err}')
+
+    def get_or_revalidate(self, key: tuple, compute,
+                          ttl: float | None = None) -> tuple[object, float | None]:
+        """Returns the cached value for a key and its age if it is stale.
+
+        An expired value is returned straight away with its age in seconds,
+        and recomputed in the background for the next request. A fresh value
+        has an age of None. If there is no value at all it is computed as in
+        get_or_compute.
+        """
+
+        with self._lock:
+            entry = self._lookup(key, stale=True)
+
+            if entry is not None and entry['expires_at'] > self._clock():
+                self.hits += 1
+                return entry['value'], None
+
+            if entry is not None:
+                self.stale += 1
+                if key not in self._in_flight:
+                    flight = Future()
+                    self._in_flight[key] = flight
+                    self._executor.submit(copy_context().run, self._revalidate,
+                                          key, compute, ttl, flight)
+                return entry['value'], self._clock() - entry['created_at']
+
+        return self.get_or_compute(key, compute, ttl), None
+
+    def clear(self) -> None:
+        """Removes every cached entry and resets the counters."""
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+            self.stale = 0
+
+    def stats(self) -> dict:
+        """Returns the cache's hit, miss and memory counts."""
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'coalesced': self.coalesced, 'stale': self.stale,
+                    'entries': len(self._entries),
+                    'bytes': self.size}
+
+
+ANALYTICS_CACHE = AnalyticsCache()
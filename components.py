@@ -1,12 +1,19 @@
 """Components for the Streamlit app."""
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import logging
 import time
 
-import requests
 import polars as pl
 import streamlit as st
+from requests.exceptions import RequestException
 
+from cache import ANALYTICS_CACHE
+from fetch import ENGINE
+from live import LIVE_POLL_INTERVAL, LiveLeague
+from profiler import profile_section
+from telemetry import TELEMETRY, TELEMETRY_PATH, tab_context
 from extract import (get_league_captain_picks,
                      get_season_league_rankings,
                      get_points_progression_data,
@@ -14,8 +21,15 @@ from extract import (get_league_captain_picks,
                      get_latest_gameweek,
                      get_league_chip_data,
                      get_overall_rankings_data,
-                     get_rankings,
-                     get_league_name)
+                     get_standings_table,
+                     iter_manager_ranks,
+                     get_league_name,
+                     get_raw_league_data,
+                     PICKS_STORE,
+                     LIVE_POINTS_STORE,
+                     HISTORY_STORE,
+                     BOOTSTRAP_CACHE,
+                     UNSETTLED_RECHECK)
 
 from visualisations import (get_manager_captains_chart,
                             get_league_rankings_chart,
@@ -25,6 +39,117 @@ from visualisations import (get_manager_captains_chart,
                             get_points_average_chart)
 
 
+# Seconds between redraws of the summary table while overall ranks download.
+RANK_REDRAW_INTERVAL = 0.25
+
+
+def get_cached_data(key: tuple, compute) -> tuple[object, float | None]:
+    """Returns data from the cache shared between sessions, and its age if stale.
+
+    Data for a gameweek that is still being scored expires so it can
+    refresh. Expired data is served straight away while it refreshes in the
+    background, so the dashboard keeps working while the FPL API is down.
+    """
+
+    gameweek = get_latest_gameweek()
+
+    ttl = None if gameweek in BOOTSTRAP_CACHE.get_finalized_gameweeks() \
+        else UNSETTLED_RECHECK
+
+    data, age = ANALYTICS_CACHE.get_or_revalidate((*key, gameweek), compute, ttl)
+
+    logging.info(f'Analytics cache: {ANALYTICS_CACHE.stats()}')
+
+    return data, age
+
+
+def get_tab_data(name: str, league_code: int, manager_ids: tuple[int, ...],
+                 compute) -> tuple[pl.DataFrame, float | None]:
+    """Returns a tab's data, and its age if stale.
+
+    Data is keyed by the managers analysed, since large leagues can be capped
+    or sampled differently.
+    """
+
+    return get_cached_data((name, league_code, manager_ids), compute)
+
+
+def get_league_data(league_code: int) -> tuple[dict, float | None]:
+    """Returns the raw data for a league, and its age if stale."""
+
+    return get_cached_data(('standings', league_code),
+                           lambda: get_raw_league_data(league_code))
+
+
+def format_age(seconds: float) -> str:
+    """Returns a short description of an age in seconds, such as '5 min'."""
+
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds // 60:.0f} min"
+    return f"{seconds // 3600:.0f} h"
+
+
+def render_data_age(age: float | None) -> None:
+    """Marks data as stale with its age, if it is being refreshed."""
+
+    if age is not None:
+        st.caption(f"⏳ Showing data from {format_age(age)} ago while it refreshes.")
+
+
+def render_api_status() -> None:
+    """Warns in the sidebar while requests to the FPL API are being refused."""
+
+    if ENGINE.breaker.state != 'closed':
+        st.sidebar.warning('The FPL API is not responding, so the last data '
+                           'downloaded is being shown.', icon="⚠️")
+
+
+def profile_tab(profile_path: str | None, name: str, stage: str,
+                manager_data: pl.DataFrame):
+    """Returns a context which profiles a stage of a tab if profile_path is set."""
+
+    if profile_path is None:
+        return nullcontext()
+
+    return profile_section(profile_path, name, stage, manager_data.height,
+                           get_latest_gameweek())
+
+
+def load_tab_data(name: str, league_code: int, manager_data: pl.DataFrame,
+                  profile_path: str | None = None) -> tuple[pl.DataFrame, float | None]:
+    """Runs the extract pipeline for a tab and logs how long it took.
+
+    Returns the tab's data, and its age if stale.
+    """
+
+    start = time.time()
+
+    with tab_context(name), profile_tab(profile_path, name, 'load', manager_data):
+        data, age = get_tab_data(name, league_code,
+                                 tuple(manager_data['manager_id'].to_list()),
+                                 lambda: TABS[name]['loader'](manager_data))
+
+    end = time.time()
+    time_elapsed = end - start
+    logging.info(f'{TABS[name]["title"]} tab: {time_elapsed}s')
+    logging.info(f'Picks store: {PICKS_STORE.stats()}')
+    logging.info(f'Live points store: {LIVE_POINTS_STORE.stats()}')
+    logging.info(f'History store: {HISTORY_STORE.stats()}')
+
+    return data, age
+
+
+def warm_up_tabs(league_code: int, manager_data: pl.DataFrame,
+                 profile_path: str | None = None) -> dict[str, Future]:
+    """Starts fetching every tab's data in the background."""
+
+    return {name: WARM_UP_EXECUTOR.submit(load_tab_data, name, league_code,
+                                          manager_data, profile_path)
+            for name in TABS}
+
+
 def render_initial_page() -> None:
     """Renders the initial page before inputting a league code."""
     st.title("⚽️ Mini League Analysis")
@@ -38,36 +163,86 @@ def render_initial_page() -> None:
                     """)
         st.image("./images/league_code.png", width=600)
 
-    st.error(
+    st.info(
         """
-        Note, this is optimised for smaller leagues
+        Large leagues are analysed for at most the number of managers set
+        in the sidebar, either from the top of the standings or a random sample.
 
-        If your league has more than **15 participants**, please expect longer waiting times""", icon="🚨")
+        Turn on **Load tabs on demand** for the quickest start in large leagues.""", icon="ℹ️")
 
 
-def render_summary_section(league_data: dict) -> None:
-    """Renders the summary section."""
+def fill_overall_ranks(table, rankings: pl.DataFrame, manager_ids: list[int],
+                       rows: list[int]) -> pl.DataFrame:
+    """Downloads each manager's overall rank, redrawing the table as they arrive.
+
+    Each manager's rank goes in the table row at the same position in rows.
+    Returns the completed table, or None if any rank couldn't be downloaded.
+    """
+
+    ranks = [None] * rankings.height
+    failed = False
+    drawn_at = time.monotonic()
+
+    for index, rank in iter_manager_ranks(manager_ids):
+        if isinstance(rank, Exception):
+            logging.warning(f'Overall rank: {rank}')
+            failed = True
+        else:
+            ranks[rows[index]] = rank
+
+        if time.monotonic() - drawn_at > RANK_REDRAW_INTERVAL:
+            table.dataframe(rankings.with_columns(
+                pl.Series('Overall Rank', ranks, pl.Int64)), hide_index=True)
+            drawn_at = time.monotonic()
+
+    rankings = rankings.with_columns(pl.Series('Overall Rank', ranks, pl.Int64))
+    table.dataframe(rankings, hide_index=True)
+
+    return None if failed else rankings
+
+
+def render_summary_section(league_data: dict, age: float | None = None,
+                           manager_ids: list[int] | None = None) -> None:
+    """Renders the summary section.
+
+    The full standings are drawn straight away from the league data, and the
+    overall rank column fills in as each analysed manager's rank downloads.
+    Every manager is analysed unless manager_ids is given. The age of stale
+    league data is shown under the title.
+    """
 
     league_name = get_league_name(league_data)
 
     st.title(league_name)
 
-    with requests.Session() as session:
-        start = time.time()
-        with st.spinner('Fetching league data...'):
-            rankings = get_rankings(league_data, session)
-        end = time.time()
-        time_elapsed = end - start
-        logging.info(f'Summary section: {time_elapsed}s')
+    render_data_age(age)
+
+    entries = [result['entry'] for result in league_data['standings']['results']]
+    analysed = set(entries if manager_ids is None else manager_ids)
+    rows = [row for row, entry in enumerate(entries) if entry in analysed]
+
+    if len(rows) < len(entries):
+        st.caption(f"Showing all {len(entries)} managers. Overall ranks and "
+                   f"the tabs below cover the {len(rows)} being analysed.")
+
+    rankings = st.session_state.get('summary_rankings')
+    complete = rankings is not None
+
+    if not complete:
+        rankings = get_standings_table(league_data)
+
+    col1, col2 = st.columns([1, 2])
+
+    with col2:
+        table = st.empty()
+        table.dataframe(rankings, hide_index=True)
 
     top_manager = rankings.sort(by='Rank')[0]
 
     top_latest_manager = rankings.sort(
         by='Latest Score', descending=True)[0]
 
-    col1, col2 = st.columns([1, 2])
-
-    with col1:
+    with col1, tab_context('summary'):
 
         st.metric(
             'Leading Manager',
@@ -78,31 +253,52 @@ def render_summary_section(league_data: dict) -> None:
                   top_latest_manager['Manager'][0],
                   delta=f"{top_latest_manager['Latest Score'][0]} points")
 
-    with col2:
-        st.dataframe(rankings, hide_index=True)
+    if not complete:
+        start = time.time()
+        with tab_context('summary'):
+            st.session_state['summary_rankings'] = fill_overall_ranks(
+                table, rankings, [entries[row] for row in rows], rows)
+        end = time.time()
+        time_elapsed = end - start
+        logging.info(f'Summary section: {time_elapsed}s')
 
 
-def render_captains_tab(manager_data: pl.DataFrame) -> None:
-    """Renders the captain performance tab."""
+def get_live_league(league_code: int, manager_data: pl.DataFrame) -> LiveLeague:
+    """Returns the live scores of the managers analysed, shared between sessions.
 
-    st.header('Captain Performance')
+    The league's picks and fixtures are downloaded once per gameweek.
+    """
 
-    if st.session_state.get('captains_data') is None:
+    gameweek = get_latest_gameweek()
 
-        start = time.time()
+    return ANALYTICS_CACHE.get_or_compute(
+        ('live', league_code, tuple(manager_data['manager_id'].to_list()), gameweek),
+        lambda: LiveLeague(manager_data, gameweek))
 
-        with st.spinner('Fetching captain data...'):
 
-            captain_picks_df = get_league_captain_picks(manager_data)
-            st.session_state['captains_data'] = captain_picks_df
+@st.fragment(run_every=LIVE_POLL_INTERVAL)
+def render_live_section(league_code: int, manager_data: pl.DataFrame) -> None:
+    """Renders the live league table, which refreshes every poll interval."""
 
-        end = time.time()
+    st.header(f'GW {get_latest_gameweek()} Live')
 
-        time_elapsed = end - start
+    try:
+        with tab_context('live'):
+            table = get_live_league(league_code, manager_data).refresh()
+    except RequestException:
+        st.error('Could not fetch live scores from the FPL API.', icon="🚨")
+        return
 
-        logging.info(f"Captain tab: {time_elapsed}s")
+    st.dataframe(table, hide_index=True)
+    st.caption(f"Automatic substitutions are provisional until fixtures are confirmed. "
+               f"Checked at {time.strftime('%H:%M:%S')}.")
 
-    captain_picks_df: pl.DataFrame = st.session_state['captains_data']
+
+@st.fragment
+def render_captains_tab(manager_data: pl.DataFrame, captain_picks_df: pl.DataFrame) -> None:
+    """Renders the captain performance tab."""
+
+    st.header('Captain Performance')
 
     selected_manager = st.selectbox(
         "Select Manager", options=manager_data['player_name'])
@@ -113,22 +309,11 @@ def render_captains_tab(manager_data: pl.DataFrame) -> None:
     st.altair_chart(captains_chart, use_container_width=True)
 
 
-def render_league_rankings_tab(manager_data: pl.DataFrame) -> None:
+def render_league_rankings_tab(manager_data: pl.DataFrame, rankings_data: pl.DataFrame) -> None:
     """Renders the league rankings tab."""
 
     st.header('League Rankings')
 
-    if st.session_state.get('rankings_data') is None:
-        start = time.time()
-        with st.spinner('Fetching league rankings...'):
-            rankings_data = get_season_league_rankings(manager_data)
-        end = time.time()
-        time_elapsed = end - start
-        logging.info(f'League rankings tab: {time_elapsed}')
-        st.session_state['rankings_data'] = rankings_data
-
-    rankings_data = st.session_state['rankings_data']
-
     # selected_players = st.multiselect(
     #     'Select Managers',
     #     options=manager_data['player_name'],
@@ -142,28 +327,16 @@ def render_league_rankings_tab(manager_data: pl.DataFrame) -> None:
     st.altair_chart(rankings_chart, use_container_width=True)
 
 
-def render_points_progression_tab(manager_data: pl.DataFrame) -> None:
+@st.fragment
+def render_points_progression_tab(manager_data: pl.DataFrame, points_progression_data: pl.DataFrame) -> None:
     """Renders the points progression tab."""
 
     st.header('Points Progression')
 
-    if st.session_state.get('points_progression') is None:
-
-        start = time.time()
-
-        with st.spinner('Fetching points...'):
-
-            points_progression_data = get_points_progression_data(manager_data)
-
-        end = time.time()
-        time_elapsed = end - start
-        logging.info(f'Points progression tab: {time_elapsed}')
-
-        st.session_state['points_progression'] = points_progression_data
-    points_progression_data = st.session_state['points_progression']
+    latest_gw = points_progression_data['Gameweek'].max()
 
     gameweeks = st.slider('Select Gameweeks', min_value=1,
-                          max_value=get_latest_gameweek(), value=(1, get_latest_gameweek()))
+                          max_value=latest_gw, value=(1, latest_gw))
 
     filtered_points_data = points_progression_data.filter(
         pl.col('Gameweek').is_between(gameweeks[0], gameweeks[1]))
@@ -174,28 +347,16 @@ def render_points_progression_tab(manager_data: pl.DataFrame) -> None:
     st.altair_chart(points_progression_chart, use_container_width=True)
 
 
-def render_points_average_tab(manager_data: pl.DataFrame) -> None:
+@st.fragment
+def render_points_average_tab(manager_data: pl.DataFrame, average_points_data: pl.DataFrame) -> None:
     """Renders the points average tab."""
 
     st.header('Rolling Points Average')
 
-    if st.session_state.get('points_average') is None:
-
-        start = time.time()
-
-        with st.spinner('Fetching averages...'):
-
-            average_points_data = get_points_average_data(manager_data)
-
-        end = time.time()
-        time_elapsed = end - start
-        logging.info(f'Points average tab: {time_elapsed}')
-
-        st.session_state['points_average'] = average_points_data
-    average_points_data = st.session_state['points_average']
+    latest_gw = average_points_data['Gameweek'].max()
 
     gameweeks = st.slider('Select Gameweeks', min_value=1,
-                          max_value=get_latest_gameweek(), value=(1, get_latest_gameweek()), key='averages')
+                          max_value=latest_gw, value=(1, latest_gw), key='averages')
 
     filtered_points_data = average_points_data.filter(
         pl.col('Gameweek').is_between(gameweeks[0], gameweeks[1]))
@@ -206,58 +367,28 @@ def render_points_average_tab(manager_data: pl.DataFrame) -> None:
     st.altair_chart(average_points_chart, use_container_width=True)
 
 
-def render_chip_usage_tab(manager_data: pl.DataFrame) -> None:
+def render_chip_usage_tab(manager_data: pl.DataFrame, chip_data: pl.DataFrame) -> None:
     """Renders the chip usage tab."""
 
     st.header("Chip Usage")
 
-    if st.session_state.get('chip_data') is None:
-
-        start = time.time()
-
-        with st.spinner("Fetching chip data..."):
-
-            chip_data = get_league_chip_data(manager_data)
-
-        end = time.time()
-
-        time_elapsed = end - start
-
-        logging.info(f'Chips tab: {time_elapsed}')
-
-        st.session_state['chip_data'] = chip_data
-
-    chip_data = st.session_state['chip_data']
-
     chips_chart = get_chips_chart(chip_data)
 
     st.altair_chart(chips_chart)
 
 
-def render_overall_rankings_tab(manager_data: pl.DataFrame) -> None:
+@st.fragment
+def render_overall_rankings_tab(manager_data: pl.DataFrame, rankings_data: pl.DataFrame) -> None:
     """Renders the overall rankings tab."""
 
     st.header("Overall Rankings")
 
-    if st.session_state.get('overall_rankings') is None:
-
-        start = time.time()
-
-        with st.spinner('Fetching rankings...'):
-            rankings_data = get_overall_rankings_data(manager_data)
-
-        end = time.time()
-        time_elapsed = end - start
-        logging.info(f'Overall points tab: {time_elapsed}')
-
-        st.session_state['overall_rankings'] = rankings_data
-
-    rankings_data = st.session_state['overall_rankings']
+    latest_gw = rankings_data['Gameweek'].max()
 
     gameweeks = st.slider('Select Gameweeks',
                           min_value=1,
-                          max_value=get_latest_gameweek(),
-                          value=(1, get_latest_gameweek()),
+                          max_value=latest_gw,
+                          value=(1, latest_gw),
                           key='rankings_slider')
 
     filtered_rankings_data = rankings_data.filter(
@@ -275,3 +406,144 @@ def render_overall_rankings_tab(manager_data: pl.DataFrame) -> None:
 
         rankings_chart = get_overall_rankings_chart(filtered_rankings_data)
         st.altair_chart(rankings_chart, use_container_width=True)
+
+
+TABS = {
+    'league_rankings': {'title': 'League Rankings',
+                        'loader': get_season_league_rankings,
+                        'render': render_league_rankings_tab},
+    'captains': {'title': 'Captain Performance',
+                 'loader': get_league_captain_picks,
+                 'render': render_captains_tab},
+    'points_progression': {'title': 'Points Progression',
+                           'loader': get_points_progression_data,
+                           'render': render_points_progression_tab},
+    'points_average': {'title': 'Points Average',
+                       'loader': get_points_average_data,
+                       'render': render_points_average_tab},
+    'chips': {'title': 'Chip Usage',
+              'loader': get_league_chip_data,
+              'render': render_chip_usage_tab},
+    'overall_rankings': {'title': 'Overall Rankings',
+                         'loader': get_overall_rankings_data,
+                         'render': render_overall_rankings_tab}
+}
+
+WARM_UP_EXECUTOR = ThreadPoolExecutor(thread_name_prefix='tab-warm-up')
+
+
+def start_tab_warm_up(league_code: int, manager_data: pl.DataFrame,
+                      profile_path: str | None = None) -> None:
+    """Starts fetching the tabs' data for this session if it hasn't started."""
+
+    if st.session_state.get('tab_futures') is None:
+        st.session_state['tab_futures'] = warm_up_tabs(
+            league_code, manager_data, profile_path)
+
+
+def render_tabs(league_code: int, manager_data: pl.DataFrame,
+                profile_path: str | None = None) -> None:
+    """Renders every tab, each one as soon as its data is ready.
+
+    All of the tabs' data is fetched concurrently when a league is submitted,
+    with a single progress bar in place of a spinner on each tab. Stale data
+    is marked with its age. Each tab is profiled if profile_path is set.
+    """
+
+    start_tab_warm_up(league_code, manager_data, profile_path)
+
+    futures = st.session_state['tab_futures']
+
+    tabs = dict(zip(TABS, st.tabs([tab['title'] for tab in TABS.values()])))
+
+    progress = st.progress(0.0, text='Fetching league data...')
+
+    names = {future: name for name, future in futures.items()}
+    stale = False
+
+    for loaded, future in enumerate(as_completed(names), 1):
+        name = names[future]
+
+        with tabs[name]:
+            try:
+                data, age = future.result()
+                stale = stale or age is not None
+                render_data_age(age)
+                with profile_tab(profile_path, name, 'render', manager_data):
+                    TABS[name]['render'](manager_data, data)
+            except RequestException:
+                st.error('Could not fetch this data from the FPL API.', icon="🚨")
+
+        progress.progress(loaded / len(futures),
+                          text=f'Loaded {loaded} of {len(futures)} tabs')
+
+    progress.empty()
+
+    # Stale data is fetched again on the next run, once it has refreshed.
+    if stale:
+        st.session_state['tab_futures'] = None
+
+
+def render_lazy_tabs(league_code: int, manager_data: pl.DataFrame,
+                     profile_path: str | None = None) -> None:
+    """Renders only the selected tab, fetching its data the first time it's opened.
+
+    Each tab's data is kept for the rest of the session, so switching back to
+    a tab doesn't fetch it again. Stale data isn't kept, so the tab picks up
+    fresh data once it has refreshed. The tab is profiled if profile_path is
+    set.
+    """
+
+    selected = st.radio('Select tab', options=list(TABS),
+                        format_func=lambda name: TABS[name]['title'],
+                        horizontal=True, label_visibility='collapsed',
+                        key='selected_tab')
+
+    if st.session_state.get('tab_data') is None:
+        st.session_state['tab_data'] = {}
+
+    tab_data = st.session_state['tab_data']
+
+    data, age = tab_data.get(selected), None
+
+    if data is None:
+        with st.spinner(f'Fetching {TABS[selected]["title"].lower()} data...'):
+            try:
+                data, age = load_tab_data(
+                    selected, league_code, manager_data, profile_path)
+            except RequestException:
+                st.error('Could not fetch this data from the FPL API.', icon="🚨")
+                return
+
+        if age is None:
+            tab_data[selected] = data
+
+    render_data_age(age)
+
+    with profile_tab(profile_path, selected, 'render', manager_data):
+        TABS[selected]['render'](manager_data, data)
+
+
+def render_telemetry_panel() -> None:
+    """Renders the request telemetry for the whole process in the sidebar."""
+
+    with st.sidebar.expander('Request telemetry', expanded=True):
+        rows = TELEMETRY.snapshot()
+
+        if not rows:
+            st.caption('No requests made yet.')
+            return
+
+        st.dataframe(pl.DataFrame(rows).drop('statuses'), hide_index=True)
+
+        st.download_button('Download JSON lines', TELEMETRY.to_json_lines(),
+                           file_name='fpl_telemetry.jsonl')
+        st.download_button('Download Prometheus metrics', TELEMETRY.to_prometheus(),
+                           file_name='fpl_telemetry.prom')
+
+
+def export_telemetry() -> None:
+    """Appends the request telemetry to FPL_TELEMETRY_PATH, if it is set."""
+
+    if TELEMETRY_PATH:
+        TELEMETRY.write_json_lines(TELEMETRY_PATH)
@@ -0,0 +1,137 @@
+"""Shared fixtures for the unit tests."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Lock, Thread
+import time
+
+import pytest
+
+import extract
+from fetch import CircuitBreaker, TokenBucket
+from mock_api import MockFPLServer, SyntheticLeague
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local HTTP server which serves fixed JSON payloads by path.
+
+    Paths in failures map to a list of error statuses which are served, in
+    order, before the payload is.
+    """
+
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.routes = {}
+        self.failures = {}
+        self.delay = 0.0
+        self.paths = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+
+    @property
+    def base_url(self) -> str:
+        """Returns the URL which stands in for the FPL API root."""
+        return f"http://127.0.0.1:{self.server_port}/api"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves the payload registered for the requested path."""
+
+    def do_GET(self) -> None:
+        """Responds with the registered payload, or a 404."""
+        server = self.server
+
+        with server.lock:
+            server.paths.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+
+        time.sleep(server.delay)
+
+        with server.lock:
+            failures = server.failures.get(self.path, [])
+            status = failures.pop(0) if failures else None
+
+        payload = server.routes.get(self.path)
+        body = json.dumps(payload).encode()
+
+        if status is None:
+            status = 200 if payload is not None else 404
+
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        """Silences the default request logging."""
+
+
+def reset_shared_state(monkeypatch) -> None:
+    """Empties the process-wide stores and caches, and stops them archiving."""
+
+    for store in (extract.PICKS_STORE, extract.LIVE_POINTS_STORE,
+                  extract.HISTORY_STORE):
+        store.clear()
+        monkeypatch.setattr(store, '_archive', None)
+    extract.BOOTSTRAP_CACHE.clear()
+    monkeypatch.setattr(extract.ENGINE, 'breaker', CircuitBreaker())
+
+
+def point_api(monkeypatch, base_url: str) -> None:
+    """Points the extract functions at an FPL API served from base_url."""
+
+    monkeypatch.setattr(extract, 'FPL_INFO_URL', f"{base_url}/bootstrap-static/")
+    monkeypatch.setattr(extract, 'LEAGUE_BASE_URL', f"{base_url}/leagues-classic")
+    monkeypatch.setattr(extract, 'MANAGER_BASE_URL', f"{base_url}/entry")
+    monkeypatch.setattr(extract, 'GAMEWEEK_BASE_URL', f"{base_url}/event")
+    monkeypatch.setattr(extract, 'FIXTURES_URL', f"{base_url}/fixtures/")
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    """Points the extract functions at a local stub of the FPL API."""
+
+    server = StubServer()
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    point_api(monkeypatch, server.base_url)
+    reset_shared_state(monkeypatch)
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name='mock_api')
+def fixture_mock_api(request, monkeypatch):
+    """Points the extract functions at a mock API serving a synthetic league.
+
+    The league is 120 managers over 3 gameweeks unless the test parametrizes
+    the fixture indirectly with SyntheticLeague's keyword arguments. The
+    shared engine's rate limit is lifted so the tests aren't paced.
+    """
+
+    league = SyntheticLeague(**getattr(request, 'param', {'managers': 120, 'gameweeks': 3}))
+    server = MockFPLServer(league)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    point_api(monkeypatch, server.base_url)
+    reset_shared_state(monkeypatch)
+    monkeypatch.setattr(extract.ENGINE, 'bucket', TokenBucket(1000.0, 16))
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -3,27 +3,34 @@
 import logging
 
 import streamlit as st
-
-from extract import get_raw_league_data, get_manager_data, is_valid_code
-from components import (render_initial_page,
+from requests.exceptions import RequestException
+
+from extract import (get_manager_data,
+                     select_managers,
+                     MAX_MANAGERS,
+                     MANAGER_SELECTIONS)
+from components import (export_telemetry,
+                        get_league_data,
+                        render_api_status,
+                        render_initial_page,
+                        render_telemetry_panel,
                         render_summary_section,
-                        render_captains_tab,
-                        render_league_rankings_tab,
-                        render_points_progression_tab,
-                        render_chip_usage_tab,
-                        render_overall_rankings_tab,
-                        render_points_average_tab)
+                        render_tabs,
+                        render_lazy_tabs,
+                        render_live_section,
+                        start_tab_warm_up)
+from fetch import APIUnavailableError
+from profiler import DEFAULT_PROFILE_PATH, PROFILE_PATH
+from telemetry import tab_context
 
 
 def reset_session() -> None:
     """Callback function which resets session state data."""
 
-    st.session_state['rankings_data'] = None
-    st.session_state['captains_data'] = None
-    st.session_state['chip_data'] = None
-    st.session_state['points_progression'] = None
-    st.session_state['overall_rankings'] = None
-    st.session_state['points_average'] = None
+    st.session_state['league_data'] = None
+    st.session_state['summary_rankings'] = None
+    st.session_state['tab_futures'] = None
+    st.session_state['tab_data'] = None
 
 
 if __name__ == "__main__":
@@ -39,45 +46,94 @@ if __name__ == "__main__":
     with st.sidebar.form('League Code Input'):
         league_code = st.number_input(
             label="Enter league code", step=1, value=None)
+        max_managers = st.number_input(
+            label="Managers to analyse", min_value=1, step=1, value=MAX_MANAGERS,
+            help="Leagues bigger than this are cut down before any analysis.")
+        selection = st.radio(
+            "Choose managers from", options=MANAGER_SELECTIONS,
+            format_func={'top': 'Top of the standings',
+                         'sample': 'Random sample'}.get,
+            horizontal=True)
         st.form_submit_button("Submit", on_click=reset_session)
 
+    lazy_tabs = st.sidebar.toggle(
+        "Load tabs on demand",
+        help="Only fetch a tab's data when it is opened. Best for large leagues.")
+
+    live_mode = st.sidebar.toggle(
+        "Live gameweek",
+        help="Follow the current gameweek's scores, with automatic substitutions, "
+             "checked every minute.")
+
+    show_telemetry = st.sidebar.toggle(
+        "Show request telemetry",
+        help="Request counts, latencies and cache hits for every session.")
+
+    profile_path = PROFILE_PATH or DEFAULT_PROFILE_PATH
+
+    profile_tabs = st.sidebar.toggle(
+        "Profile tabs", value=PROFILE_PATH is not None,
+        disabled=PROFILE_PATH is not None,
+        help=f"Save CPU and memory profiles of each tab to {profile_path}/.")
+
+    if not profile_tabs:
+        profile_path = None
+
+    league_data = st.session_state.get('league_data')
+    league_age = None
+    api_unavailable = False
+
+    if league_code is not None and league_data is None:
+        try:
+            with tab_context('standings'):
+                league_data, league_age = get_league_data(league_code)
+        except APIUnavailableError:
+            api_unavailable = True
+        except RequestException:
+            pass
+
+        # Stale standings aren't kept, so the next run picks up fresh ones.
+        if league_age is None:
+            st.session_state['league_data'] = league_data
+
     if league_code is None:
         render_initial_page()
 
-    elif is_valid_code(league_code) is False:
+    elif league_data is None:
         render_initial_page()
-        st.sidebar.error("Invalid league code", icon="🚨", )
+        if api_unavailable:
+            st.sidebar.error("The FPL API is unavailable right now. Please try again shortly.",
+                             icon="🚨")
+        else:
+            st.sidebar.error("Invalid league code", icon="🚨", )
 
     else:
-        league_data = get_raw_league_data(league_code)
+        manager_data = get_manager_data(
+            select_managers(league_data, max_managers, selection))
+
+        manager_ids = manager_data['manager_id'].to_list()
+
+        if lazy_tabs:
+            render_summary_section(league_data, league_age, manager_ids)
 
-        render_summary_section(league_data)
+            if live_mode:
+                render_live_section(league_code, manager_data)
 
-        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-            'League Rankings',
-            'Captain Performance',
-            'Points Progression',
-            'Points Average',
-            'Chip Usage',
-            'Overall Rankings'
-        ])
+            render_lazy_tabs(league_code, manager_data, profile_path)
 
-        manager_data = get_manager_data(league_data)
+        else:
+            start_tab_warm_up(league_code, manager_data, profile_path)
 
-        with tab1:
-            render_league_rankings_tab(manager_data)
+            render_summary_section(league_data, league_age, manager_ids)
 
-        with tab2:
-            render_captains_tab(manager_data)
+            if live_mode:
+                render_live_section(league_code, manager_data)
 
-        with tab3:
-            render_points_progression_tab(manager_data)
+            render_tabs(league_code, manager_data, profile_path)
 
-        with tab4:
-            render_points_average_tab(manager_data)
+    render_api_status()
 
-        with tab5:
-            render_chip_usage_tab(manager_data)
+    if show_telemetry:
+        render_telemetry_panel()
 
-        with tab6:
-            render_overall_rankings_tab(manager_data)
+    export_telemetry()
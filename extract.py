@@ -1,423 +1,801 @@
 """Functions which extract data for the Streamlit app."""
 
-from concurrent.futures import ThreadPoolExecutor
-from itertools import repeat
-import numpy
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+import logging
+import os
+import random
+from threading import Lock
 import time
 
 import polars as pl
-import requests
 from requests.exceptions import RequestException
 
+from archive import ARCHIVE, GameweekArchive
+from fetch import ENGINE, APIUnavailableError, FetchEngine
+from spill import SPILL
+from telemetry import TELEMETRY
 
-FPL_INFO_URL = "https://fantasy.premierleague.com/api/bootstrap-static/"
-LEAGUE_BASE_URL = "https://fantasy.premierleague.com/api/leagues-classic"
-MANAGER_BASE_URL = "https://fantasy.premierleague.com/api/entry"
-GAMEWEEK_BASE_URL = "https://fantasy.premierleague.com/api/event"
+
+# Root of the FPL API, which can point at the mock API in mock_api.py.
+FPL_API_URL = os.environ.get('FPL_API_URL', "https://fantasy.premierleague.com/api")
+
+FPL_INFO_URL = f"{FPL_API_URL}/bootstrap-static/"
+LEAGUE_BASE_URL = f"{FPL_API_URL}/leagues-classic"
+MANAGER_BASE_URL = f"{FPL_API_URL}/entry"
+GAMEWEEK_BASE_URL = f"{FPL_API_URL}/event"
+FIXTURES_URL = f"{FPL_API_URL}/fixtures/"
 
 MANAGER_COLS = ['entry', 'player_name', 'entry_name']
 
+HISTORY_COLS = ['points', 'total_points', 'overall_rank',
+                'points_on_bench', 'event_transfers', 'event_transfers_cost']
+
+HISTORY_SCHEMA = {'manager_id': pl.Int64, 'gameweek': pl.Int64,
+                  **{col: pl.Int64 for col in HISTORY_COLS}}
+
+CHIP_SCHEMA = {'manager_id': pl.Int64, 'chip': pl.String,
+               'gameweek': pl.Int64, 'points': pl.Int64}
+
+CAPTAIN_SCHEMA = {'manager_id': pl.Int64, 'gameweek': pl.Int64,
+                  'id': pl.Int64, 'multiplier': pl.Int64}
+
 CHIP_CONVERSIONS = {'3xc': 'Triple Captain',
                     'freehit': 'Free Hit', 'bboost': 'Bench Boost'}
 
+SECOND_WILDCARD_GW = 21
+
+PLAYER_COLS = ['id', 'web_name', 'team', 'element_type', 'now_cost']
+
+# Most standings pages requested at once after the first page, which says
+# whether there are any more. Batches start at one page and double up to
+# this, so small leagues don't request pages that don't exist.
+MAX_STANDINGS_PAGE_BATCH = 16
+
+# Managers analysed by default in leagues bigger than this, and how they
+# are chosen: the top of the standings, or a random sample.
+MAX_MANAGERS = 50
+MANAGER_SELECTIONS = ('top', 'sample')
+
+# Leagues analysed with more managers than this are fetched a batch of
+# INGEST_BATCH_SIZE managers at a time, spilled to Parquet on disk and
+# aggregated lazily, so memory use doesn't grow with the league.
+OUT_OF_CORE_MANAGERS = 500
+INGEST_BATCH_SIZE = 100
+
+# Seconds to wait before re-checking bootstrap-static while the current
+# gameweek is still being played or its data hasn't been checked yet.
+UNSETTLED_RECHECK = 300
+
+# Seconds to keep serving a stale bootstrap-static payload after a refresh
+# fails because the API is down, before trying again.
+STALE_RETRY = 30
+
+
+class DocumentStore(ABC):
+    """Caches downloaded FPL API documents by key.
+
+    Each key is downloaded at most once while it stays in the store, so every
+    tab and session that needs the same document shares the same request. The
+    store is shared by the whole process and holds at most max_documents,
+    evicting the least recently used ones beyond that. Missing keys
+    are downloaded together through the fetch engine, and any that downloaded
+    successfully are kept even if others in the batch fail.
+
+    Documents for finished gameweeks are also saved to the on-disk archive and
+    read back from there before anything is downloaded. Documents for a
+    gameweek that is still being scored expire after UNSETTLED_RECHECK
+    seconds so they are downloaded again with the latest scores.
+    """
+
+    kind = None
+    max_documents = 2000
+
+    def __init__(self, engine: FetchEngine = ENGINE,
+                 archive: GameweekArchive | None = None,
+                 clock=time.time) -> None:
+        self._engine = engine
+        self._archive = archive
+        self._clock = clock
+        self._documents = OrderedDict()
+        self._expires_at = {}
+        self._in_flight = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.archived = 0
+
+    @abstractmethod
+    def _url(self, key: tuple) -> str:
+        """Returns the URL of the document for a key."""
+
+    @abstractmethod
+    def _archive_key(self, key: tuple) -> tuple[int, int]:
+        """Returns the (manager ID, gameweek) the document for a key belongs to."""
+
+    def _finalized(self, keys: list[tuple]) -> dict:
+        """Returns the archive key for each key whose gameweek is finalized."""
+
+        if self._archive is None or not keys:
+            return {}
+
+        finalized = BOOTSTRAP_CACHE.get_finalized_gameweeks()
+        archive_keys = {key: self._archive_key(key) for key in keys}
+
+        return {key: archive_key for key, archive_key in archive_keys.items()
+                if archive_key[1] in finalized}
+
+    def _parse(self, data: dict):
+        """Converts a downloaded payload into the form held by the store."""
+
+        return data
+
+    def get_many(self, keys: list[tuple]) -> list:
+        """Returns the documents for a list of keys, in the same order.
+
+        Keys already being loaded by another thread aren't loaded again;
+        this waits for that thread's result instead.
+        """
+
+        with self._lock:
+            now = self._clock()
+            found = {key: self._documents[key] for key in keys
+                     if key in self._documents and self._expires_at[key] > now}
+            for key in found:
+                self._documents.move_to_end(key)
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            waiting = {key: self._in_flight[key] for key in missing
+                       if key in self._in_flight}
+            owned = [key for key in missing if key not in waiting]
+            for key in owned:
+                self._in_flight[key] = Future()
+            self.hits += len(keys) - len(missing)
+            self.coalesced += len(waiting)
+
+        try:
+            loaded, errors, fetched = self._load(owned, now)
+        except Exception as err:
+            self._settle(owned, {}, {key: err for key in owned})
+            raise
+
+        self._settle(owned, loaded, errors)
+        found.update(loaded)
+
+        for key, flight in waiting.items():
+            try:
+                found[key] = flight.result()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                errors[key] = err
+
+        if keys:
+            TELEMETRY.record_cache(self._url(keys[0]),
+                                   len(keys) - fetched, fetched)
+
+        if errors:
+            raise next(iter(errors.values()))
+
+        return [found[key] for key in keys]
+
+    def _load(self, keys: list[tuple], now: float) -> tuple[dict, dict, int]:
+        """Loads documents from the archive, or downloads them, and stores them.
+
+        Returns the documents that loaded, the error for each key that
+        didn't, and the number of keys downloaded.
+        """
+
+        finalized = self._finalized(keys)
+        season = BOOTSTRAP_CACHE.get_season() if finalized else None
 
-def get_raw_league_data(league_code: int) -> dict:
-    """Returns a python dictionary of the raw data for a given league."""
+        archived = self._archive.load_many(
+            season, self.kind, list(finalized.values())) if finalized else {}
 
-    res = requests.get(
-        f"{LEAGUE_BASE_URL}/{league_code}/standings", timeout=10)
+        found = {key: self._parse(archived[archive_key])
+                 for key, archive_key in finalized.items() if archive_key in archived}
 
-    if res.status_code == 200:
-        return res.json()
+        to_fetch = [key for key in keys if key not in found]
 
-    raise RequestException("Error - invalid league code.")
+        payloads = self._engine.fetch_many(
+            [self._url(key) for key in to_fetch], return_exceptions=True)
 
+        errors = {key: payload for key, payload in zip(to_fetch, payloads)
+                  if isinstance(payload, Exception)}
 
-def is_valid_code(league_code: int) -> bool:
-    """Checks if the given league code is valid."""
+        downloaded = {key: payload for key, payload in zip(to_fetch, payloads)
+                      if not isinstance(payload, Exception)}
 
-    res = requests.get(
-        f"{LEAGUE_BASE_URL}/{league_code}/standings", timeout=10)
+        for key, payload in downloaded.items():
+            found[key] = self._parse(payload)
 
-    if res.status_code == 200:
-        return True
-    return False
+        if finalized:
+            self._archive.save_many(season, self.kind, {
+                finalized[key]: payload for key, payload in downloaded.items()
+                if key in finalized})
 
+        with self._lock:
+            self.misses += len(to_fetch)
+            self.archived += len(keys) - len(to_fetch)
+            for key in keys:
+                if key in found:
+                    self._documents[key] = found[key]
+                    self._documents.move_to_end(key)
+                    self._expires_at[key] = float('inf') if key in finalized \
+                        else now + UNSETTLED_RECHECK
+            while len(self._documents) > self.max_documents:
+                key, _ = self._documents.popitem(last=False)
+                del self._expires_at[key]
 
-def get_manager_data(league_data: dict) -> pl.DataFrame:
-    """Returns data for each manager in a given league."""
+        return found, errors, len(to_fetch)
 
-    managers = league_data['standings']['results']
+    def _settle(self, keys: list[tuple], found: dict, errors: dict) -> None:
+        """Hands the result for each key loaded by this thread to any waiting threads."""
 
-    manager_df = pl.DataFrame(managers)
+        with self._lock:
+            flights = [self._in_flight.pop(key) for key in keys]
 
-    return manager_df[MANAGER_COLS].rename({'entry': 'manager_id'})
+        for key, flight in zip(keys, flights):
+            if key in found:
+                flight.set_result(found[key])
+            else:
+                flight.set_exception(errors[key])
 
+    def stats(self) -> dict:
+        """Returns the number of cache hits and misses."""
 
-def get_league_name(league_data: dict) -> str:
-    """Returns the league name from the raw league data."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'coalesced': self.coalesced, 'archived': self.archived,
+                    'size': len(self._documents)}
 
-    return league_data['league']['name']
+    def clear(self) -> None:
+        """Empties the store and resets the counters."""
 
+        with self._lock:
+            self._documents.clear()
+            self._expires_at.clear()
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+            self.archived = 0
 
-def get_latest_gameweek() -> int:
-    """Returns the latest gameweek ID."""
 
-    res = requests.get(FPL_INFO_URL, timeout=10)
+class PicksStore(DocumentStore):
+    """Caches the picks document for each (manager, gameweek) pair."""
+
+    kind = 'picks'
+    max_documents = 5000
+
+    def _url(self, key: tuple) -> str:
+        manager_id, gw = key
+        return f"{MANAGER_BASE_URL}/{manager_id}/event/{gw}/picks"
+
+    def _archive_key(self, key: tuple) -> tuple[int, int]:
+        return key
+
+    def get(self, manager_id: int, gw: int) -> dict:
+        """Returns the picks document for a manager in a given gameweek."""
+
+        return self.get_many([(int(manager_id), int(gw))])[0]
+
+
+class LivePointsStore(DocumentStore):
+    """Caches a points table for each gameweek from the live endpoint.
+
+    The table is held as a frame of player ID and points, to be joined to
+    picks.
+    """
+
+    kind = 'live'
+    max_documents = 64
+
+    def _url(self, key: tuple) -> str:
+        return f"{GAMEWEEK_BASE_URL}/{key[0]}/live"
+
+    def _archive_key(self, key: tuple) -> tuple[int, int]:
+        return 0, key[0]
+
+    def _parse(self, data: dict) -> pl.DataFrame:
+        """Reduces the live payload to each player's total points."""
+
+        return pl.DataFrame(
+            {'id': [player['id'] for player in data['elements']],
+             'player_score': [player['stats']['total_points']
+                              for player in data['elements']]},
+            schema={'id': pl.Int64, 'player_score': pl.Int64})
+
+    def get(self, gw: int) -> pl.DataFrame:
+        """Returns the points table for a given gameweek."""
+
+        return self.get_many([(int(gw),)])[0]
+
+
+class HistoryStore(DocumentStore):
+    """Caches the season history document for each (manager, current gameweek) pair.
+
+    A history document grows every gameweek, so it is keyed by the gameweek
+    that was current when it was downloaded. Once that gameweek is finalized
+    the document stops changing, and the next gameweek gets a new one.
+    """
+
+    kind = 'history'
+
+    def _url(self, key: tuple) -> str:
+        return f"{MANAGER_BASE_URL}/{key[0]}/history"
+
+    def _archive_key(self, key: tuple) -> tuple[int, int]:
+        return key
+
+    def get(self, manager_id: int) -> dict:
+        """Returns the season history document for a manager."""
+
+        return self.get_many([(int(manager_id), BOOTSTRAP_CACHE.get_current_gameweek())])[0]
+
+
+class PlayerIndex:
+    """Player metadata from bootstrap-static, indexed by player ID.
+
+    Holds each player's name, team, position and price in one frame so whole
+    columns of player IDs are resolved with a single join, rather than by
+    filtering the player table for each ID.
+    """
+
+    def __init__(self, players: pl.DataFrame) -> None:
+        self.players = players
+
+    @classmethod
+    def from_bootstrap(cls, data: dict) -> 'PlayerIndex':
+        """Builds the index from a bootstrap-static payload."""
+
+        teams = pl.DataFrame(data['teams'])
+        positions = pl.DataFrame(data['element_types'])
+
+        players = pl.DataFrame(data['elements'])[PLAYER_COLS].select(
+            pl.col('id'),
+            pl.col('web_name'),
+            pl.col('team').replace_strict(
+                teams['id'], teams['short_name']).alias('team'),
+            pl.col('element_type').replace_strict(
+                positions['id'], positions['singular_name_short']).alias('position'),
+            (pl.col('now_cost') / 10).alias('price'),
+            pl.col('team').alias('team_id'))
+
+        return cls(players.sort('id'))
+
+    def resolve(self, ids, columns: list[str] | None = None) -> pl.DataFrame:
+        """Returns the metadata for a sequence of player IDs, in the same order.
+
+        IDs which aren't in the index get nulls.
+        """
+
+        ids = pl.DataFrame({'id': ids}, schema={'id': pl.Int64})
+
+        return self.enrich(ids, columns=columns)
+
+    def enrich(self, frame, on: str = 'id', columns: list[str] | None = None):
+        """Adds player metadata columns to a frame or lazy frame of player IDs."""
+
+        players = self.players.select(
+            pl.col('id').alias(on), *(columns or self.players.columns[1:]))
+
+        if isinstance(frame, pl.LazyFrame):
+            players = players.lazy()
 
-    if res.status_code == 200:
+        return frame.join(players, on=on, how='left', maintain_order='left')
 
-        gameweeks = res.json()['events']
 
-        for gw in gameweeks:
+class BootstrapCache:
+    """Caches the parsed bootstrap-static payload.
+
+    The payload only changes when a gameweek deadline passes or the current
+    gameweek is still being scored, so the cached copy is kept until the next
+    deadline once the current gameweek is finished and data checked. While
+    the API is down the last payload downloaded is served instead.
+    """
+
+    def __init__(self, engine: FetchEngine = ENGINE, clock=time.time) -> None:
+        self._engine = engine
+        self._clock = clock
+        self._lock = Lock()
+        self._events = None
+        self._player_index = None
+        self._expires_at = 0.0
+
+    def _refresh(self) -> None:
+        """Downloads and parses the payload if the cached copy has expired."""
+
+        if self._events is not None and self._clock() < self._expires_at:
+            return
+
+        try:
+            data = self._engine.fetch(FPL_INFO_URL)
+        except APIUnavailableError as err:
+            if self._events is None:
+                raise
+            logging.warning(f'Serving stale bootstrap-static: {err}')
+            self._expires_at = self._clock() + STALE_RETRY
+            return
+
+        self._events = data['events']
+        self._player_index = PlayerIndex.from_bootstrap(data)
+        self._expires_at = get_bootstrap_expiry(self._events, self._clock())
+
+    def get_events(self) -> list[dict]:
+        """Returns the list of gameweek events."""
+
+        with self._lock:
+            self._refresh()
+            return self._events
+
+    def get_players(self) -> pl.DataFrame:
+        """Returns the player table."""
+
+        return self.get_player_index().players
+
+    def get_player_index(self) -> PlayerIndex:
+        """Returns the player metadata index."""
+
+        with self._lock:
+            self._refresh()
+            return self._player_index
+
+    def get_current_gameweek(self) -> int:
+        """Returns the current gameweek ID."""
+
+        for gw in self.get_events():
             if gw['is_current']:
                 return gw['id']
-    raise RequestException("Error - FPL API could not be accessed.")
+        raise RequestException("Error - no gameweek is currently active.")
 
+    def get_season(self) -> int:
+        """Returns the year the current season started in."""
 
-def get_player_data() -> pl.DataFrame:
-    """Returns basic player info."""
+        return datetime.fromisoformat(self.get_events()[0]['deadline_time']).year
 
-    res = requests.get(FPL_INFO_URL, timeout=10)
+    def get_finalized_gameweeks(self) -> set[int]:
+        """Returns the IDs of gameweeks which are finished and data checked."""
 
-    if res.status_code == 200:
+        return {gw['id'] for gw in self.get_events()
+                if gw['finished'] and gw['data_checked']}
 
-        player_data = res.json()['elements']
+    def clear(self) -> None:
+        """Forces the next lookup to download the payload again."""
 
-        return pl.DataFrame(player_data)[['id', 'web_name']]
+        with self._lock:
+            self._events = None
+            self._player_index = None
+            self._expires_at = 0.0
 
-    raise RequestException("Error - could not access the FPL API.")
 
+def get_bootstrap_expiry(events: list[dict], now: float) -> float:
+    """Returns the timestamp at which a bootstrap-static payload goes stale."""
 
-def get_captain(
-        manager_id: int,
-        gw: int,
-        player_data: pl.DataFrame,
-        session: requests.Session) -> pl.DataFrame:
-    """Returns the player ID of the managers captain for a given gameweek."""
+    upcoming = [datetime.fromisoformat(gw['deadline_time']).timestamp()
+                for gw in events
+                if datetime.fromisoformat(gw['deadline_time']).timestamp() > now]
 
-    res = session.get(
-        f"{MANAGER_BASE_URL}/{manager_id}/event/{gw}/picks", timeout=10)
+    expires_at = min(upcoming, default=float('inf'))
 
-    if res.status_code == 200:
+    current = next((gw for gw in events if gw['is_current']), None)
 
-        picks = res.json()['picks']
+    if current is not None and not (current['finished'] and current['data_checked']):
+        expires_at = min(expires_at, now + UNSETTLED_RECHECK)
 
-        captain_id = next(pick['element']
-                          for pick in picks if pick['is_captain'])
+    return expires_at
 
-        captain_info = player_data.filter(id=captain_id)
 
-        player_score = get_player_score(captain_info['id'][0], gw, session)
+PICKS_STORE = PicksStore(archive=ARCHIVE)
+LIVE_POINTS_STORE = LivePointsStore(archive=ARCHIVE)
+HISTORY_STORE = HistoryStore(archive=ARCHIVE)
+BOOTSTRAP_CACHE = BootstrapCache()
 
-        captain_data = {'id': captain_info['id'][0],
-                        'web_name': captain_info['web_name'][0], 'gameweek': gw, 'manager_id': manager_id, 'player_score': player_score}
 
-        return captain_data
+def get_standings_pages(url: str, first_page: int) -> list[dict]:
+    """Returns every standings page after the first one for a league.
 
-    raise RequestException("Error - could not access FPL API.")
+    Pages are fetched concurrently in batches, which double in size up to
+    MAX_STANDINGS_PAGE_BATCH, until one says it is the last.
+    """
 
+    pages = []
+    next_page = first_page + 1
+    batch_size = 1
 
-def get_manager_captain_picks(
-        manager_id: int,
-        player_data: pl.DataFrame,
-        session: requests.Session) -> pl.DataFrame:
-    """Returns the captain picks for a manager."""
+    while True:
+        batch = ENGINE.fetch_many(
+            [f"{url}?page_standings={page}"
+             for page in range(next_page, next_page + batch_size)],
+            return_exceptions=True)
 
-    latest_gw = get_latest_gameweek()
+        for page in batch:
+            if isinstance(page, Exception):
+                raise page
+            pages.append(page)
+            if not page['standings']['has_next']:
+                return pages
 
-    # captain_picks = pl.DataFrame()
+        next_page += batch_size
+        batch_size = min(batch_size * 2, MAX_STANDINGS_PAGE_BATCH)
 
-    # for gw in range(1, latest_gw + 1):
-    #     captain = get_captain(manager_id, gw, player_data, session)
-    #     captain = captain.with_columns(
-    #         pl.lit(gw).alias("gameweek")
-    #     )
-    #     captain = captain.with_columns(
-    #         pl.lit(manager_id).alias("manager_id")
-    #     )
-    #     captain_picks = pl.concat([captain_picks, captain])
 
-    current_gw = get_latest_gameweek()
-    chunks = (current_gw // 5) + 1
-    gameweeks = list(range(1, current_gw + 1))
-    gameweek_chunks = numpy.array_split(gameweeks, chunks)
+def get_raw_league_data(league_code: int) -> dict:
+    """Returns a python dictionary of the raw data for a given league.
 
-    captain_picks = []
-    for gws in gameweek_chunks:
-        with ThreadPoolExecutor() as executor:
+    The standings of every page are merged into the first page's. An
+    APIUnavailableError is raised as it is, since it doesn't mean the code
+    is invalid.
+    """
 
-            captain_picks.append(list(executor.map(get_captain, repeat(
-                manager_id), gws, repeat(player_data), repeat(session))))
+    url = f"{LEAGUE_BASE_URL}/{league_code}/standings"
 
-    captain_picks = [item for row in captain_picks for item in row]
+    try:
+        league_data = ENGINE.fetch(url)
+        standings = league_data['standings']
 
-    # for gw in range(1, latest_gw + 1):
-    #     captain_picks.append(get_captain(manager_id, gw, player_data, session))
+        results = list(standings['results'])
+        if standings['has_next']:
+            for page in get_standings_pages(url, standings['page']):
+                results += page['standings']['results']
+    except APIUnavailableError:
+        raise
+    except RequestException as err:
+        raise RequestException("Error - invalid league code.") from err
 
-    return captain_picks
+    return {**league_data,
+            'standings': {**standings, 'has_next': False, 'results': results}}
 
 
-def get_manager_prev_scores(manager_id: int) -> pl.DataFrame:
-    """Returns managers previous scores for this season."""
+def select_managers(league_data: dict, max_managers: int | None = MAX_MANAGERS,
+                    selection: str = 'top') -> dict:
+    """Returns the league data limited to the managers being analysed.
 
-    res = requests.get(f"{MANAGER_BASE_URL}/{manager_id}/history", timeout=10)
+    Either the top of the standings or a random sample of at most max_managers
+    is kept, in standings order. The sample is seeded so it is the same on
+    every run.
+    """
 
-    if res.status_code == 200:
-        gameweeks = res.json()['current']
+    if selection not in MANAGER_SELECTIONS:
+        raise ValueError(f"Unknown manager selection: {selection}")
 
-        gameweek_df = pl.DataFrame(gameweeks)
+    results = league_data['standings']['results']
 
-        gameweek_df = gameweek_df.rename(
-            {"event": "Gameweek", "points": "Points"})
+    if max_managers is None or len(results) <= max_managers:
+        return league_data
 
-        gameweek_df = gameweek_df.with_columns(
-            pl.lit(manager_id).alias('Manager ID'))
+    if selection == 'top':
+        results = results[:max_managers]
+    else:
+        results = [results[i] for i in sorted(
+            random.Random(0).sample(range(len(results)), max_managers))]
 
-        return gameweek_df[["Gameweek", "Points", "Manager ID"]]
+    return {**league_data,
+            'standings': {**league_data['standings'], 'results': results}}
 
-    raise ValueError("Error - invalid manager ID provided.")
 
+def is_valid_code(league_code: int) -> bool:
+    """Checks if the given league code is valid."""
 
-def get_player_score(player_id: int, gw: int, session: requests.Session) -> int:
-    """Returns the score of a player in a given gameweek."""
+    try:
+        get_raw_league_data(league_code)
+    except RequestException:
+        return False
+    return True
 
-    res = session.get(f"{GAMEWEEK_BASE_URL}/{gw}/live", timeout=10)
 
-    if res.status_code != 200:
-        raise RequestException("Error - could not access FPL API.")
+def get_manager_data(league_data: dict) -> pl.DataFrame:
+    """Returns data for each manager in a given league."""
 
-    players = res.json()['elements']
+    managers = league_data['standings']['results']
 
-    player = next(player for player in players if player['id'] == player_id)
+    manager_df = pl.DataFrame(managers)
 
-    return player['stats']['total_points']
+    return manager_df[MANAGER_COLS].rename({'entry': 'manager_id'})
 
 
-def get_gw_manager_data(gameweek: int, manager_id: int):
-    """Returns all the necessary data for a given manager in a given gameweek."""
+def get_league_name(league_data: dict) -> str:
+    """Returns the league name from the raw league data."""
 
-    res = requests.get(
-        f"{MANAGER_BASE_URL}/{manager_id}/event/{gameweek}/picks", timeout=10)
+    return league_data['league']['name']
 
-    if res.status_code != 200:
-        raise ConnectionError("Could not connect to the API.")
-    content = res.json()
 
-    return content
+def get_latest_gameweek() -> int:
+    """Returns the latest gameweek ID."""
+
+    return BOOTSTRAP_CACHE.get_current_gameweek()
 
 
-def get_league_rankings_for_gw(
-        manager_data: pl.DataFrame,
-        gameweek: int,
-        session: requests.Session) -> dict:
-    """Returns the league standings for a given gameweek."""
+def get_gw_manager_data(gameweek: int, manager_id: int):
+    """Returns all the necessary data for a given manager in a given gameweek."""
 
-    points = {}
+    return PICKS_STORE.get(manager_id, gameweek)
 
-    for manager_id in manager_data['manager_id']:
-        res = session.get(
-            f"{MANAGER_BASE_URL}/{manager_id}/event/{gameweek}/picks", timeout=10)
-        if res.status_code != 200:
-            print(res.status_code)
-            print(res.headers)
-            raise ConnectionError(
-                f"Could not retrieve gameweek {gameweek} data for manager {manager_id}")
-        data = res.json()
-        total_points = data['entry_history']['total_points']
-        points[manager_id] = total_points
 
-    rankings = [{"manager_id": key, "rank": rank, "gameweek": gameweek} for rank, key in enumerate(
-        sorted(points, key=points.get, reverse=True), 1)]
+def get_league_histories(manager_ids: list[int]) -> list[dict]:
+    """Returns the season history document for each manager."""
 
-    return rankings
+    gw = get_latest_gameweek()
+
+    return HISTORY_STORE.get_many([(int(manager_id), gw) for manager_id in manager_ids])
 
 
 def get_season_league_rankings(manager_data: pl.DataFrame) -> pl.DataFrame:
     """Returns a dataframe of league rankings over the season."""
 
-    league_size = manager_data['manager_id'].count()
+    history = scan_league_history(manager_data).sort(
+        'manager_id', 'gameweek')
 
-    current_gw = get_latest_gameweek()
-    chunks = (current_gw // 5) + 1
-    gameweeks = list(range(1, current_gw + 1))
-    gameweek_chunks = numpy.array_split(gameweeks, chunks)
+    rankings_data = history.select(
+        pl.col('manager_id'),
+        pl.col('total_points').rank(method='min', descending=True)
+        .over('gameweek').alias('rank'),
+        pl.col('gameweek'),
+        pl.col('player_name'),
+        pl.col('entry_name'))
 
-    rankings = []
+    return rankings_data.collect(engine='streaming')
 
-    if league_size < 10:
 
-        for gws in gameweek_chunks:
-            with requests.Session() as session:
-                with ThreadPoolExecutor() as executor:
-                    rankings += list(executor.map(get_league_rankings_for_gw, repeat(
-                        manager_data), gws, repeat(session)))
+def get_history_frames(manager_ids: list[int]) -> dict[str, pl.DataFrame]:
+    """Returns the gameweek history and chip tables for a batch of managers."""
 
-        rankings = [item for row in rankings for item in row]
+    histories = get_league_histories(manager_ids)
 
-    else:
-        with requests.Session() as session:
-            with ThreadPoolExecutor() as executor:
-                for gw in range(1, current_gw + 1):
-                    rankings += executor.submit(get_league_rankings_for_gw,
-                                                manager_data, gw, session).result()
+    gameweeks = [{'manager_id': manager_id, 'gameweek': gw['event'],
+                  **{col: gw[col] for col in HISTORY_COLS}}
+                 for manager_id, history in zip(manager_ids, histories)
+                 for gw in history['current']]
 
-    rankings_df = pl.DataFrame(rankings)
+    chips = [chip
+             for manager_id, history in zip(manager_ids, histories)
+             for chip in get_manager_chip_data(manager_id, history)]
 
-    rankings_data = rankings_df.join(manager_data, on='manager_id')
+    return {'history': pl.DataFrame(gameweeks, schema=HISTORY_SCHEMA),
+            'chips': pl.DataFrame(chips, schema=CHIP_SCHEMA)}
 
-    return rankings_data
 
+def get_captain_frames(manager_ids: list[int]) -> dict[str, pl.DataFrame]:
+    """Returns the captain picked by a batch of managers in each gameweek."""
 
-def get_league_captain_picks(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns a dataframe of every manager's captain for each gameweek and their score."""
+    keys = [(int(manager_id), gw) for manager_id in manager_ids
+            for gw in range(1, get_latest_gameweek() + 1)]
+
+    picks = PICKS_STORE.get_many(keys)
+
+    captains = [{'manager_id': manager_id, 'gameweek': gw,
+                 'id': captain['element'], 'multiplier': captain['multiplier']}
+                for (manager_id, gw), document in zip(keys, picks)
+                for captain in document['picks'] if captain['is_captain']]
+
+    return {'captains': pl.DataFrame(captains, schema=CAPTAIN_SCHEMA)}
+
+
+def scan_league_table(dataset: str, table: str, manager_ids: list[int],
+                      get_frames, schemas: dict) -> pl.LazyFrame:
+    """Returns a lazy frame of one table of a dataset for the league's managers.
+
+    Leagues with more than OUT_OF_CORE_MANAGERS managers are fetched and
+    spilled to disk a batch at a time, and scanned back from Parquet.
+    """
 
-    player_data = get_player_data()
+    if len(manager_ids) <= OUT_OF_CORE_MANAGERS:
+        return get_frames(manager_ids)[table].lazy()
 
-    # captain_picks_df = pl.DataFrame()
+    gameweek = get_latest_gameweek()
 
-    # with requests.Session() as session:
-    #     for manager_id in manager_data["manager_id"]:
-    #         temp_df = get_manager_captain_picks(
-    #             manager_id, player_data, session)
-    #         captain_picks_df = pl.concat([captain_picks_df, temp_df])
+    ttl = None if gameweek in BOOTSTRAP_CACHE.get_finalized_gameweeks() \
+        else UNSETTLED_RECHECK
 
-    captain_picks = []
+    def batches():
+        for start in range(0, len(manager_ids), INGEST_BATCH_SIZE):
+            yield get_frames(manager_ids[start:start + INGEST_BATCH_SIZE])
 
-    with requests.Session() as session:
+    return SPILL.scan(
+        (dataset, BOOTSTRAP_CACHE.get_season(), gameweek, tuple(manager_ids)),
+        table, batches, schemas, ttl)
 
-        for manager_id in manager_data["manager_id"]:
-            captain_picks += get_manager_captain_picks(
-                manager_id, player_data, session)
 
-        captain_picks_df = pl.DataFrame(captain_picks)
+def scan_league_history(manager_data: pl.DataFrame,
+                        table: str = 'history') -> pl.LazyFrame:
+    """Returns a lazy frame of the league's gameweek history or chips table."""
 
-        # start = time.time()
+    history = scan_league_table(
+        'history', table, manager_data['manager_id'].to_list(),
+        get_history_frames, {'history': HISTORY_SCHEMA, 'chips': CHIP_SCHEMA})
 
-        # captain_picks_df = captain_picks_df.with_columns(
-        #     pl.struct(['id', 'gameweek']).map_elements(
-        #         lambda x: get_player_score(x['id'], x['gameweek'], session)
-        #     ).alias('player_score'))
+    return history.join(manager_data.lazy(), on='manager_id')
 
-        # end = time.time()
-        # print(end - start)
 
-    captain_picks_df = captain_picks_df.join(
-        manager_data,
-        left_on=pl.col("manager_id").cast(pl.Int64),
-        right_on=pl.col("manager_id").cast(pl.Int64))
+def get_league_captain_picks(manager_data: pl.DataFrame) -> pl.DataFrame:
+    """Returns a dataframe of every manager's captain for each gameweek and their score.
 
-    return captain_picks_df
+    Every manager's picks and every gameweek's live points are downloaded in
+    one batch, then matched to the captains with a single join.
+    """
 
+    gameweeks = list(range(1, get_latest_gameweek() + 1))
 
-def get_points_data(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns a dataframe of points per gameweek for each manager."""
+    LIVE_POINTS_STORE.get_many([(gw,) for gw in gameweeks])
 
-    gameweek_df = pl.DataFrame()
+    live_points = pl.concat([LIVE_POINTS_STORE.get(gw).with_columns(
+        gameweek=pl.lit(gw, pl.Int64)) for gw in gameweeks])
 
-    for manager_id in manager_data["manager_id"]:
-        manager_df = get_manager_prev_scores(manager_id)
-        gameweek_df = pl.concat([gameweek_df, manager_df])
+    captains = scan_league_table(
+        'captains', 'captains', manager_data['manager_id'].to_list(),
+        get_captain_frames, {'captains': CAPTAIN_SCHEMA})
 
-    gameweek_df = gameweek_df.join(manager_data, left_on=pl.col(
-        'Manager ID').cast(pl.Int64), right_on='manager_id')
+    captain_picks = BOOTSTRAP_CACHE.get_player_index().enrich(
+        captains.join(live_points.lazy(), on=['id', 'gameweek'], how='left'),
+        columns=['web_name', 'team', 'position']).join(
+        manager_data.lazy(), on='manager_id')
 
-    return gameweek_df
+    return captain_picks.select(
+        'id', 'web_name', 'team', 'position', 'gameweek', 'manager_id',
+        'multiplier',
+        'player_score',
+        (pl.col('player_score') * pl.col('multiplier')).alias('captain_points'),
+        *manager_data.columns[1:]).collect(engine='streaming')
 
 
 def get_points_progression_data(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns the overall rankings data for each manager over the season."""
+    """Returns the cumulative points for each manager over the season."""
 
-    gameweek_df = get_points_data(manager_data)
+    history = scan_league_history(manager_data).sort(
+        'manager_id', 'gameweek')
 
-    cum_gameweeks_df = gameweek_df.select(pl.col('Gameweek'), pl.col(
-        'player_name'), pl.col('Points').cum_sum().over('Manager ID'))
+    cum_gameweeks_df = history.select(
+        pl.col('gameweek').alias('Gameweek'),
+        pl.col('player_name'),
+        pl.col('points').cum_sum().over('manager_id').alias('Points'))
 
-    return cum_gameweeks_df
+    return cum_gameweeks_df.collect(engine='streaming')
 
 
 def get_points_average_data(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns the overall rankings data for each manager over the season."""
-
-    gameweek_df = get_points_data(manager_data)
-
-    av_gameweeks_df = gameweek_df.select(pl.col('Gameweek'), pl.col(
-        'player_name'), pl.col('Points').rolling_mean(window_size=get_latest_gameweek(), min_periods=1))
-
-    return av_gameweeks_df
-
-
-def get_manager_chip_data(manager_id: int, session: requests.Session) -> dict:
-    """Returns a dictionary of manager chip scores."""
-
-    chip_data = []
-
-    # chip_data = {'manager_id': manager_id, 'wildcard_1': None, 'wildard_2': None,
-    #              '3xc': None, 'bboost': None, 'freehit': None}
-
-    for gw in list(range(1, get_latest_gameweek() + 1)):
-        res = session.get(
-            f"{MANAGER_BASE_URL}/{manager_id}/event/{gw}/picks")
-        if res.status_code != 200:
-            print(res.status_code)
-            raise RequestException(f"{res.status_code} error")
-        data = res.json()
-        if data.get('active_chip'):
-            if data['active_chip'] == 'wildcard':
-                if gw < 21:
-                    chip_data.append({
-                        'manager_id': manager_id,
-                        'chip': 'Wildcard 1',
-                        'points': data['entry_history']['points']
-                    })
-                    continue
-                chip_data.append({
-                    'manager_id': manager_id,
-                    'chip': 'Wildcard 2',
-                    'points': data['entry_history']['points']
-                })
-                continue
-            chip_data.append({
-                'manager_id': manager_id,
-                'chip': CHIP_CONVERSIONS[data['active_chip']],
-                'points': data['entry_history']['points']})
-    return chip_data
-
+    """Returns the running average points for each manager over the season."""
 
-def get_league_chip_data(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns the chip data for every manager in the league."""
+    history = scan_league_history(manager_data).sort(
+        'manager_id', 'gameweek')
 
-    chip_data = []
+    av_gameweeks_df = history.select(
+        pl.col('gameweek').alias('Gameweek'),
+        pl.col('player_name'),
+        (pl.col('points').cum_sum() / pl.col('points').cum_count())
+        .over('manager_id').alias('Points'))
 
-    manager_ids = manager_data['manager_id'].to_list()
+    return av_gameweeks_df.collect(engine='streaming')
 
-    with requests.Session() as session:
-        with ThreadPoolExecutor() as executor:
 
-            chip_data += list(executor.map(get_manager_chip_data,
-                              manager_ids, repeat(session)))
+def get_manager_chip_data(manager_id: int, history: dict) -> list[dict]:
+    """Returns the chips a manager has played and the points scored with each."""
 
-    chip_data = [item for row in chip_data for item in row]
+    points = {gw['event']: gw['points'] for gw in history['current']}
 
-    # for manager_id in manager_data['manager_id']:
-    #     chip_data += get_manager_chip_data(manager_id, session)
+    return [{'manager_id': manager_id, 'chip': chip['name'],
+             'gameweek': chip['event'], 'points': points.get(chip['event'])}
+            for chip in history['chips']]
 
-    chip_data = pl.DataFrame(chip_data)
 
-    chip_data = chip_data.join(manager_data, on='manager_id')
+def get_league_chip_data(manager_data: pl.DataFrame) -> pl.DataFrame:
+    """Returns the chip data for every manager in the league."""
 
-    return chip_data
+    chip_data = scan_league_history(manager_data, 'chips')
 
+    chip_data = chip_data.with_columns(
+        pl.when(pl.col('chip') != 'wildcard')
+        .then(pl.col('chip').replace(CHIP_CONVERSIONS))
+        .when(pl.col('gameweek') < SECOND_WILDCARD_GW)
+        .then(pl.lit('Wildcard 1'))
+        .otherwise(pl.lit('Wildcard 2'))
+        .alias('chip'))
 
-def get_rankings(league_data: dict, session: requests.Session) -> pl.DataFrame:
-    """Gets the league rankings."""
+    return chip_data.collect(engine='streaming')
 
-    rankings_data = league_data['standings']['results']
 
-    rankings_data = pl.DataFrame(rankings_data)
+def get_standings_table(league_data: dict) -> pl.DataFrame:
+    """Returns the league standings, with the overall ranks not yet filled in."""
 
-    rankings_data = rankings_data.with_columns(pl.col('entry').apply(
-        lambda x: get_manager_rank(x, session)).alias('Overall Rank'))
+    rankings_data = pl.DataFrame(league_data['standings']['results'])
 
     rankings_data = rankings_data.select(
         pl.col('rank').alias('Rank'),
@@ -425,59 +803,60 @@ def get_rankings(league_data: dict, session: requests.Session) -> pl.DataFrame:
         pl.col('entry_name').alias('Team Name'),
         pl.col('total').alias('Total Points'),
         pl.col('event_total').alias('Latest Score'),
-        pl.col('Overall Rank')
+        pl.lit(None, pl.Int64).alias('Overall Rank')
     )
 
     return rankings_data
 
 
-def get_manager_prev_rankings(manager_id: int) -> pl.DataFrame:
-    """Returns managers previous rankings for this season."""
+def get_rankings(league_data: dict) -> pl.DataFrame:
+    """Gets the league rankings."""
 
-    res = requests.get(f"{MANAGER_BASE_URL}/{manager_id}/history", timeout=10)
+    manager_ids = [result['entry']
+                   for result in league_data['standings']['results']]
 
-    if res.status_code == 200:
-        gameweeks = res.json()['current']
+    return get_standings_table(league_data).with_columns(pl.Series(
+        'Overall Rank', get_manager_ranks(manager_ids), pl.Int64))
 
-        gameweek_df = pl.DataFrame(gameweeks)
 
-        gameweek_df = gameweek_df.rename(
-            {"event": "Gameweek", "overall_rank": "Overall Rank"})
+def get_overall_rankings_data(manager_data: pl.DataFrame) -> pl.DataFrame:
+    """Returns the overall rankings data for each manager in the league."""
 
-        gameweek_df = gameweek_df.with_columns(
-            pl.lit(manager_id).alias('Manager ID'))
+    history = scan_league_history(manager_data).sort(
+        'manager_id', 'gameweek')
 
-        return gameweek_df[["Gameweek", "Overall Rank", "Manager ID"]]
+    rankings_data = history.select(
+        pl.col('gameweek').alias('Gameweek'),
+        pl.col('overall_rank').alias('Overall Rank'),
+        pl.col('manager_id').alias('Manager ID'),
+        pl.col('player_name'),
+        pl.col('entry_name'))
 
-    raise ValueError("Error - invalid manager ID provided.")
+    return rankings_data.collect(engine='streaming')
 
 
-def get_overall_rankings_data(manager_data: pl.DataFrame) -> pl.DataFrame:
-    """Returns the overall rankings data for each manager in the league."""
-
-    rankings_data = pl.DataFrame()
+def get_manager_ranks(manager_ids: list[int]) -> list[int]:
+    """Returns the current overall rank of each manager."""
 
-    for manager_id in manager_data['manager_id']:
-        manager_df = get_manager_prev_rankings(manager_id)
-        rankings_data = pl.concat([rankings_data, manager_df])
+    managers = ENGINE.fetch_many(
+        [f"{MANAGER_BASE_URL}/{manager_id}" for manager_id in manager_ids])
 
-    rankings_data = rankings_data.with_columns(
-        rankings_data['Manager ID'].cast(pl.Int64))
+    return [manager['summary_overall_rank'] for manager in managers]
 
-    rankings_data = rankings_data.join(
-        manager_data, left_on='Manager ID', right_on='manager_id')
-    return rankings_data
 
+def iter_manager_ranks(manager_ids: list[int]):
+    """Yields (position, overall rank) for each manager as soon as it downloads.
 
-def get_manager_rank(manager_id: int, session: requests.Session) -> int:
-    """Returns the manager's current rank."""
+    A rank which couldn't be downloaded is yielded as its exception.
+    """
 
-    res = session.get(f"{MANAGER_BASE_URL}/{manager_id}")
+    urls = [f"{MANAGER_BASE_URL}/{manager_id}" for manager_id in manager_ids]
 
-    if res.status_code == 200:
-        data = res.json()
-        return data['summary_overall_rank']
-    raise RequestException(f"{res.status_code} error")
+    for index, manager in ENGINE.fetch_as_completed(urls):
+        if isinstance(manager, Exception):
+            yield index, manager
+        else:
+            yield index, manager['summary_overall_rank']
 
 
 if __name__ == "__main__":
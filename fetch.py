@@ -0,0 +1,442 @@
+"""Asynchronous fetch engine used for every FPL API request."""
+
+import asyncio
+from collections.abc import Mapping
+from concurrent.futures import as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import json
+import logging
+import random
+from threading import Lock, Thread
+import time
+
+import aiohttp
+from requests.exceptions import RequestException
+
+from fixtures import RECORD_PATH, FixtureStore
+from telemetry import TELEMETRY, Telemetry, get_current_tab
+
+
+MAX_CONCURRENCY = 16
+REQUEST_TIMEOUT = 10
+
+# Requests per second allowed by the token bucket, and how many can be sent
+# in a burst after a quiet spell.
+RATE_LIMIT = 25.0
+RATE_BURST = MAX_CONCURRENCY
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Total retries allowed across all the requests in one fetch_many call, so a
+# struggling API can't hold a refresh open indefinitely.
+RETRY_BUDGET = 200
+
+# Consecutive failed requests which open the circuit breaker, and seconds it
+# stays open before a trial request is let through.
+BREAKER_THRESHOLD = 10
+BREAKER_RESET = 30.0
+
+
+class APIUnavailableError(RequestException):
+    """Raised when the FPL API is failing, rather than a document not existing."""
+
+
+class CircuitOpenError(APIUnavailableError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Limits the rate at which requests are sent.
+
+    Tokens refill continuously at a fixed rate up to the bucket's capacity,
+    and every request takes one. The bucket can also be paused when the API
+    asks us to back off with a Retry-After header.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, capacity: float = RATE_BURST,
+                 clock=time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Takes a token if one is free, otherwise returns how long to wait."""
+
+        now = self._clock()
+
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """Waits until a request is allowed to be sent."""
+
+        while (wait := self.reserve()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Stops any requests being sent for a number of seconds."""
+
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class RetryBudget:
+    """Counts the retries remaining for a batch of requests."""
+
+    def __init__(self, total: int = RETRY_BUDGET) -> None:
+        self.total = total
+        self.remaining = total
+        self._lock = Lock()
+
+    def take(self) -> bool:
+        """Uses up a retry, returning False if none are left."""
+
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Stops requests being sent while the API is failing.
+
+    The circuit opens after a run of consecutive failed requests, and every
+    request is refused while it is open. Once the reset timeout has passed a
+    single trial request is let through, which closes the circuit if it
+    succeeds and opens it again if it fails.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET, clock=time.monotonic) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """Returns 'closed', 'open', or 'half-open' once a trial is allowed."""
+
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self) -> bool:
+        """Checks if a request can be sent, taking the trial if one is due."""
+
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        """Closes the circuit after a request the API answered."""
+
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """Counts a failed request, opening the circuit if there are too many."""
+
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None
+                               and self._failures >= self.threshold):
+                if not self._trial:
+                    logging.warning(f'Circuit opened after {self._failures} failed requests')
+                self._opened_at = self._clock()
+            self._trial = False
+
+
+def is_failure(status: int | None) -> bool:
+    """Checks if a response status means the API is failing or throttling us."""
+
+    return status is None or status in RETRY_STATUSES
+
+
+def get_backoff(attempt: int) -> float:
+    """Returns a jittered exponential backoff delay for a retry attempt."""
+
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Returns the delay in seconds requested by a Retry-After header."""
+
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class FetchEngine:
+    """Fetches JSON documents on a single background event loop.
+
+    Every request in the process shares one connection pool and one
+    concurrency limit, so callers can hand over all of their URLs at once and
+    the number of requests in flight stays at the limit until the queue drains.
+
+    Requests are paced by a token bucket. Throttled or failed requests are
+    retried with jittered exponential backoff, honouring Retry-After, until
+    they run out of attempts or their batch's retry budget is spent. A
+    Retry-After longer than BACKOFF_CAP fails the request straight away
+    rather than stalling every other caller behind it.
+
+    A circuit breaker refuses requests straight away while the API is
+    failing, raising CircuitOpenError, so callers can fall back to cached
+    data without waiting for timeouts.
+
+    Every attempt is recorded in the telemetry against the tab of the caller
+    which asked for it. With a recorder, every document downloaded is also
+    saved as a fixture for the mock API to replay.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY,
+                 timeout: float = REQUEST_TIMEOUT,
+                 rate_limit: float = RATE_LIMIT,
+                 retry_budget: int = RETRY_BUDGET,
+                 max_attempts: int = MAX_ATTEMPTS,
+                 telemetry: Telemetry = TELEMETRY,
+                 recorder: FixtureStore | None = None) -> None:
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget
+        self.bucket = TokenBucket(rate_limit, max(1, max_concurrency))
+        self.breaker = CircuitBreaker()
+        self.telemetry = telemetry
+        self.recorder = recorder
+        self._lock = Lock()
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """Starts the event loop thread if it isn't already running."""
+
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                Thread(target=loop.run_forever, daemon=True,
+                       name='fpl-fetch-engine').start()
+                asyncio.run_coroutine_threadsafe(
+                    self._open(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _open(self) -> None:
+        """Creates the HTTP session and concurrency limit on the loop."""
+
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _attempt(self, url: str, retry: bool, tab: str,
+                       headers: dict | None = None) -> tuple[dict | None, int | None, Mapping]:
+        """Sends one request, returning the document, status and response headers."""
+
+        async with self._semaphore:
+            await self.bucket.acquire()
+            start = time.monotonic()
+            status, body, response_headers = None, b'', {}
+            try:
+                async with self._session.get(url, headers=headers) as res:
+                    status = res.status
+                    body = await res.read()
+                    response_headers = res.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            self.telemetry.record_request(
+                url, status, time.monotonic() - start, len(body),
+                retry=retry, tab=tab)
+
+        if is_failure(status):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        if status == 200:
+            return json.loads(body), 200, response_headers
+        return None, status, response_headers
+
+    async def _fetch_response(self, url: str, budget: RetryBudget, tab: str,
+                              headers: dict | None = None) -> tuple[dict | None, Mapping]:
+        """Downloads a single JSON document, retrying if it fails.
+
+        Returns the document and the response headers. The document is None
+        if a conditional request was answered with 304 Not Modified.
+        """
+
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Circuit open - not requesting {url} while the API is failing")
+
+            document, status, response_headers = await self._attempt(
+                url, attempt > 0, tab, headers)
+
+            if status == 200:
+                if self.recorder is not None:
+                    self.recorder.save(url, document)
+                return document, response_headers
+
+            if status == 304:
+                return None, response_headers
+
+            if status is not None and status not in RETRY_STATUSES:
+                break
+
+            retry_after = parse_retry_after(response_headers.get('Retry-After'))
+
+            if retry_after is not None and retry_after > BACKOFF_CAP:
+                break
+
+            if attempt + 1 == self.max_attempts or not budget.take():
+                break
+
+            if retry_after is not None:
+                self.bucket.pause(retry_after)
+                await asyncio.sleep(retry_after)
+            else:
+                await asyncio.sleep(get_backoff(attempt))
+
+        error = APIUnavailableError if is_failure(status) else RequestException
+        raise error(f"{status or 'Connection'} error - could not retrieve {url}")
+
+    async def _fetch(self, url: str, budget: RetryBudget, tab: str) -> dict:
+        """Downloads a single JSON document, retrying if it fails."""
+
+        document, _ = await self._fetch_response(url, budget, tab)
+        return document
+
+    async def _fetch_all(self, urls: list[str], return_exceptions: bool,
+                         tab: str) -> list:
+        """Downloads every URL, queued behind the shared concurrency limit."""
+
+        budget = RetryBudget(self.retry_budget)
+
+        return await asyncio.gather(*(self._fetch(url, budget, tab) for url in urls),
+                                    return_exceptions=return_exceptions)
+
+    def fetch_many(self, urls: list[str], return_exceptions: bool = False) -> list:
+        """Returns the JSON documents for a list of URLs, in the same order.
+
+        With return_exceptions, failed URLs are returned as their exception
+        instead of discarding the documents that were downloaded successfully.
+        """
+
+        if not urls:
+            return []
+
+        loop = self._start()
+
+        return asyncio.run_coroutine_threadsafe(
+            self._fetch_all(urls, return_exceptions, get_current_tab()), loop).result()
+
+    def fetch_as_completed(self, urls: list[str]):
+        """Yields (position, document) for each URL as soon as it downloads.
+
+        A URL which fails yields its exception in place of the document. All
+        of the URLs share one retry budget, as they do in fetch_many.
+        """
+
+        if not urls:
+            return
+
+        loop = self._start()
+        budget = RetryBudget(self.retry_budget)
+        tab = get_current_tab()
+
+        futures = {asyncio.run_coroutine_threadsafe(
+            self._fetch(url, budget, tab), loop): index
+            for index, url in enumerate(urls)}
+
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except RequestException as err:
+                yield futures[future], err
+
+    def fetch(self, url: str) -> dict:
+        """Returns the JSON document for a single URL."""
+
+        return self.fetch_many([url])[0]
+
+    def fetch_if_modified(self, url: str, etag: str | None = None,
+                          last_modified: str | None = None) -> tuple[dict | None, str | None,
+                                                                     str | None]:
+        """Returns the JSON document for a URL unless it hasn't changed.
+
+        The ETag and Last-Modified of the previous response are sent as
+        If-None-Match and If-Modified-Since. Returns the document, or None if
+        it hasn't changed, along with the ETag and Last-Modified to send next
+        time.
+        """
+
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+        loop = self._start()
+
+        document, response_headers = asyncio.run_coroutine_threadsafe(
+            self._fetch_response(url, RetryBudget(self.retry_budget),
+                                 get_current_tab(), headers), loop).result()
+
+        return (document, response_headers.get('ETag', etag),
+                response_headers.get('Last-Modified', last_modified))
+
+    def close(self) -> None:
+        """Closes the HTTP session and stops the event loop."""
+
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(
+                self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+ENGINE = FetchEngine(
+    recorder=FixtureStore(RECORD_PATH) if RECORD_PATH else None)
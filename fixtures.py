@@ -0,0 +1,57 @@
+"""Recorded FPL API responses, saved as JSON files named after their URL."""
+
+import json
+import os
+from threading import Lock
+from urllib.parse import urlsplit
+
+
+RECORD_PATH = os.environ.get('FPL_RECORD_PATH')
+
+
+def get_fixture_name(url: str) -> str:
+    """Returns the file a URL's response is saved to, relative to the fixtures.
+
+    The name is the path after /api/, with any query string kept after an @,
+    so the same URL maps to the same file whichever host served it.
+    """
+
+    parts = urlsplit(url)
+    name = parts.path.split('/api/', 1)[-1].strip('/')
+
+    if parts.query:
+        name = f"{name}@{parts.query}"
+
+    return f"{name}.json"
+
+
+class FixtureStore:
+    """Saves and loads API responses in a directory of JSON files."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = Lock()
+
+    def _file(self, url: str) -> str:
+        """Returns the full path of the file for a URL."""
+
+        return os.path.join(self.path, get_fixture_name(url))
+
+    def save(self, url: str, document: dict) -> None:
+        """Saves the response for a URL, replacing any saved before."""
+
+        file = self._file(url)
+
+        with self._lock:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, 'w', encoding='utf-8') as fixture:
+                json.dump(document, fixture)
+
+    def load(self, url: str) -> dict | None:
+        """Returns the saved response for a URL, or None if there isn't one."""
+
+        try:
+            with open(self._file(url), encoding='utf-8') as fixture:
+                return json.load(fixture)
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,319 @@
+"""Live gameweek scoring from picks loaded once and one polled document.
+
+Every manager's picks for the current gameweek, and the gameweek's fixtures,
+are downloaded once per league. After that each refresh polls only the
+gameweek's live document, which is shared by every league and session and
+requested conditionally, so an unchanged document isn't downloaded again.
+The league's live points, captain returns, automatic substitutions and rank
+changes are then recomputed from the picks in a few whole-frame passes.
+"""
+
+from datetime import datetime
+from threading import Lock
+import time
+
+import polars as pl
+
+import extract
+from extract import BOOTSTRAP_CACHE, ENGINE, PICKS_STORE
+from fetch import FetchEngine
+
+
+# Seconds between polls of the live document.
+LIVE_POLL_INTERVAL = 60
+
+# Seconds after kick-off a fixture is assumed to have finished, so starters
+# who haven't played by then are substituted.
+FIXTURE_LENGTH = 2 * 3600
+
+STARTERS = 11
+BENCH_SLOTS = (12, 13, 14, 15)
+
+POSITIONS = ('GKP', 'DEF', 'MID', 'FWD')
+
+# Fewest players of each outfield position allowed in the starting eleven.
+MIN_FORMATION = {'DEF': 3, 'MID': 2, 'FWD': 1}
+
+LIVE_SCHEMA = {'id': pl.Int64, 'points': pl.Int64, 'minutes': pl.Int64}
+
+PICK_SCHEMA = {'manager_id': pl.Int64, 'slot': pl.Int64, 'id': pl.Int64,
+               'multiplier': pl.Int64, 'is_captain': pl.Boolean,
+               'is_vice_captain': pl.Boolean}
+
+ENTRY_SCHEMA = {'manager_id': pl.Int64, 'chip': pl.String,
+                'previous_total': pl.Int64, 'transfer_cost': pl.Int64}
+
+FIXTURE_SCHEMA = {'team_id': pl.Int64, 'finishes_at': pl.Float64}
+
+
+def parse_live_points(document: dict) -> pl.DataFrame:
+    """Returns every player's points and minutes from a live document."""
+
+    return pl.DataFrame(
+        [{'id': player['id'], 'points': player['stats']['total_points'],
+          'minutes': player['stats'].get('minutes', 0)}
+         for player in document['elements']], schema=LIVE_SCHEMA)
+
+
+class LivePointsPoller:
+    """Polls each gameweek's live document with conditional requests.
+
+    The poller is shared by every session, so the live document is requested
+    at most once per interval however many leagues are being followed. Each
+    new version of the document gets a new version number, so callers can
+    skip recomputing when nothing has changed.
+    """
+
+    def __init__(self, engine: FetchEngine = ENGINE,
+                 interval: float = LIVE_POLL_INTERVAL, clock=time.monotonic) -> None:
+        self._engine = engine
+        self.interval = interval
+        self._clock = clock
+        self._lock = Lock()
+        self._gameweeks = {}
+
+    def poll(self, gw: int) -> tuple[pl.DataFrame, int]:
+        """Returns every player's live points and minutes, and their version."""
+
+        with self._lock:
+            state = self._gameweeks.get(gw)
+            now = self._clock()
+
+            if state is not None and now - state['polled_at'] < self.interval:
+                return state['live'], state['version']
+
+            document, etag, last_modified = self._engine.fetch_if_modified(
+                f"{extract.GAMEWEEK_BASE_URL}/{gw}/live",
+                *((state['etag'], state['last_modified']) if state else (None, None)))
+
+            if document is not None:
+                state = {'live': parse_live_points(document),
+                         'version': state['version'] + 1 if state else 1}
+
+            state.update(etag=etag, last_modified=last_modified, polled_at=now)
+            self._gameweeks[gw] = state
+
+            return state['live'], state['version']
+
+    def clear(self) -> None:
+        """Forgets every document, so the next poll downloads it again."""
+
+        with self._lock:
+            self._gameweeks.clear()
+
+
+LIVE_POLLER = LivePointsPoller()
+
+
+def get_pick_frames(manager_ids: list[int], gw: int) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Returns every manager's picks in a gameweek, and their chip and points before it."""
+
+    documents = PICKS_STORE.get_many([(int(manager_id), gw) for manager_id in manager_ids])
+
+    picks = [{'manager_id': manager_id, 'slot': pick['position'], 'id': pick['element'],
+              'multiplier': pick['multiplier'], 'is_captain': pick['is_captain'],
+              'is_vice_captain': pick['is_vice_captain']}
+             for manager_id, document in zip(manager_ids, documents)
+             for pick in document['picks']]
+
+    entries = [{'manager_id': manager_id, 'chip': document['active_chip'],
+                'previous_total': (document['entry_history']['total_points']
+                                   - document['entry_history']['points']
+                                   + document['entry_history']['event_transfers_cost']),
+                'transfer_cost': document['entry_history']['event_transfers_cost']}
+               for manager_id, document in zip(manager_ids, documents)]
+
+    picks = BOOTSTRAP_CACHE.get_player_index().enrich(
+        pl.DataFrame(picks, schema=PICK_SCHEMA), columns=['web_name', 'position', 'team_id'])
+
+    return picks, pl.DataFrame(entries, schema=ENTRY_SCHEMA)
+
+
+def get_fixture_frame(gw: int) -> pl.DataFrame:
+    """Returns the time each team's last fixture of a gameweek finishes.
+
+    Fixtures which had finished when they were downloaded finish at 0, and
+    the rest FIXTURE_LENGTH after they kick off.
+    """
+
+    fixtures = ENGINE.fetch(f"{extract.FIXTURES_URL}?event={gw}")
+
+    finishes = [{'team_id': team,
+                 'finishes_at': 0.0 if fixture['finished'] or fixture['finished_provisional']
+                 else datetime.fromisoformat(fixture['kickoff_time']).timestamp()
+                 + FIXTURE_LENGTH if fixture['kickoff_time'] else float('inf')}
+                for fixture in fixtures
+                for team in (fixture['team_h'], fixture['team_a'])]
+
+    return pl.DataFrame(finishes, schema=FIXTURE_SCHEMA).group_by('team_id').agg(
+        pl.col('finishes_at').max())
+
+
+def get_replaced_position(slot: int) -> pl.Expr:
+    """Returns the position of the starter the bench player in a slot replaces.
+
+    The bench player has to have played, and a starter who didn't play has to
+    be left whose place they can take without breaking the formation. A
+    starter in the same position is replaced first, then the first position
+    in pitch order which can spare a player. Goalkeepers only replace
+    goalkeepers.
+    """
+
+    position = pl.col(f'position_{slot}')
+    replaced = pl.when(~pl.col(f'played_{slot}') | (pl.col('chip') == 'bboost')).then(None)
+
+    for bench_position in POSITIONS:
+        candidates = ['GKP'] if bench_position == 'GKP' else \
+            [bench_position, *(other for other in MIN_FORMATION if other != bench_position)]
+
+        for candidate in candidates:
+            condition = (position == bench_position) & (pl.col(f'out_{candidate}') > 0)
+            if candidate != bench_position:
+                condition &= pl.col(f'count_{candidate}') > MIN_FORMATION[candidate]
+            replaced = replaced.when(condition).then(pl.lit(candidate))
+
+    return replaced.otherwise(None)
+
+
+def get_auto_subs(picks: pl.DataFrame, entries: pl.DataFrame) -> pl.DataFrame:
+    """Returns whether each bench pick comes on as an automatic substitute.
+
+    Every manager's bench is worked through in priority order at the same
+    time, keeping count of the starters left to replace and the eleven's
+    formation. Nobody is substituted while the bench boost is played.
+    """
+
+    slot = pl.col('slot')
+    starter = slot <= STARTERS
+
+    lineups = picks.group_by('manager_id').agg(
+        *((starter & (pl.col('position') == position)).sum().alias(f'count_{position}')
+          for position in POSITIONS),
+        *((starter & pl.col('out') & (pl.col('position') == position)).sum()
+          .alias(f'out_{position}') for position in POSITIONS),
+        *(pl.col(column).filter(slot == bench_slot).first().alias(f'{column}_{bench_slot}')
+          for bench_slot in BENCH_SLOTS for column in ('position', 'played')))
+
+    lineups = lineups.join(entries.select('manager_id', 'chip'), on='manager_id', how='left')
+
+    for bench_slot in BENCH_SLOTS:
+        lineups = lineups.with_columns(
+            get_replaced_position(bench_slot).alias(f'replaces_{bench_slot}'))
+
+        replaced = pl.col(f'replaces_{bench_slot}')
+        lineups = lineups.with_columns(
+            *((pl.col(f'out_{position}') - (replaced == position).fill_null(False))
+              .alias(f'out_{position}') for position in POSITIONS),
+            *((pl.col(f'count_{position}') - (replaced == position).fill_null(False)
+               + (replaced.is_not_null() & (pl.col(f'position_{bench_slot}') == position)))
+              .alias(f'count_{position}') for position in POSITIONS))
+
+    return pl.concat([lineups.select(
+        'manager_id', pl.lit(bench_slot, pl.Int64).alias('slot'),
+        pl.col(f'replaces_{bench_slot}').is_not_null().alias('subbed_on'))
+        for bench_slot in BENCH_SLOTS])
+
+
+def score_league(picks: pl.DataFrame, entries: pl.DataFrame, live: pl.DataFrame,
+                 fixtures: pl.DataFrame, manager_data: pl.DataFrame,
+                 now: float) -> pl.DataFrame:
+    """Returns the live league table from the picks and the latest live points.
+
+    A starter who hasn't played once their team's fixtures have finished is
+    replaced from the bench, and if it's the captain the vice captain takes
+    the armband. Rank changes are against the standings before the gameweek.
+    """
+
+    picks = picks.join(live, on='id', how='left').join(
+        fixtures, on='team_id', how='left').with_columns(
+        pl.col('points').fill_null(0),
+        (pl.col('minutes').fill_null(0) > 0).alias('played'),
+        (pl.col('finishes_at').fill_null(0) <= now).alias('done'))
+
+    picks = picks.with_columns((pl.col('done') & ~pl.col('played')).alias('out'))
+
+    picks = picks.join(get_auto_subs(picks, entries), on=['manager_id', 'slot'], how='left')
+
+    captain_out = (pl.col('is_captain') & pl.col('out')).any().over('manager_id')
+    armband = (pl.col('is_captain') & ~captain_out) | (pl.col('is_vice_captain') & captain_out)
+
+    picks = picks.with_columns(armband.alias('armband')).with_columns(
+        pl.when(pl.col('armband'))
+        .then(pl.col('multiplier').filter(pl.col('is_captain')).first().over('manager_id'))
+        .when((pl.col('slot') <= STARTERS) | pl.col('subbed_on'))
+        .then(1)
+        .otherwise(pl.col('multiplier'))
+        .alias('effective_multiplier'))
+
+    returns = (pl.col('points') * pl.col('effective_multiplier'))
+
+    managers = picks.group_by('manager_id').agg(
+        returns.sum().alias('gross_points'),
+        pl.col('web_name').filter(pl.col('armband')).first().alias('captain'),
+        returns.filter(pl.col('armband')).first().alias('captain_points'),
+        pl.col('subbed_on').fill_null(False).sum().cast(pl.Int64).alias('auto_subs'))
+
+    table = manager_data.join(managers, on='manager_id', how='left').join(
+        entries, on='manager_id', how='left').with_columns(
+        (pl.col('gross_points') - pl.col('transfer_cost')).alias('live_points')).with_columns(
+        (pl.col('previous_total') + pl.col('live_points')).alias('total'))
+
+    rank = pl.col('total').rank(method='min', descending=True).cast(pl.Int64)
+    start_rank = pl.col('previous_total').rank(method='min', descending=True).cast(pl.Int64)
+
+    return table.select(
+        rank.alias('Rank'),
+        (start_rank - rank).alias('Change'),
+        pl.col('player_name').alias('Manager'),
+        pl.col('entry_name').alias('Team Name'),
+        pl.col('live_points').alias('Live Points'),
+        pl.col('total').alias('Total Points'),
+        pl.col('captain').alias('Captain'),
+        pl.col('captain_points').alias('Captain Points'),
+        pl.col('auto_subs').alias('Auto Subs')).sort('Rank', 'Manager')
+
+
+class LiveLeague:
+    """Scores a league's managers live during a gameweek.
+
+    The picks and fixtures are downloaded when the league is created, and each
+    refresh only polls the live document. The table is recomputed when a new
+    version of the document arrives or another team's fixtures finish.
+    """
+
+    def __init__(self, manager_data: pl.DataFrame, gameweek: int,
+                 poller: LivePointsPoller = LIVE_POLLER, clock=time.time) -> None:
+        self.manager_data = manager_data
+        self.gameweek = gameweek
+        self._poller = poller
+        self._clock = clock
+        self._lock = Lock()
+        self._state = None
+        self._table = None
+        self.picks, self.entries = get_pick_frames(
+            manager_data['manager_id'].to_list(), gameweek)
+        self.fixtures = get_fixture_frame(gameweek)
+
+    def estimated_size(self) -> int:
+        """Returns the approximate memory used by the league's frames in bytes."""
+
+        frames = [self.manager_data, self.picks, self.entries, self.fixtures]
+        if self._table is not None:
+            frames.append(self._table)
+
+        return sum(frame.estimated_size() for frame in frames)
+
+    def refresh(self) -> pl.DataFrame:
+        """Returns the live league table, recomputed if anything has changed."""
+
+        live, version = self._poller.poll(self.gameweek)
+        now = self._clock()
+
+        state = (version, self.fixtures.filter(pl.col('finishes_at') <= now).height)
+
+        with self._lock:
+            if state != self._state:
+                self._table = score_league(self.picks, self.entries, live,
+                                           self.fixtures, self.manager_data, now)
+                self._state = state
+            return self._table
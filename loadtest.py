@@ -0,0 +1,228 @@
+"""Load tests the dashboard with many concurrent sessions against the mock FPL API.
+
+Each step opens a number of headless dashboard sessions at once through
+Streamlit's app testing API. Like the Streamlit server, it runs every
+session's script on its own thread in this process, so the sessions share
+the fetch engine, the tab warm-up pool and every cache. Each session enters
+the league code and waits for the dashboard to finish rendering. The caches
+are emptied between steps so every step starts cold.
+
+The mock API runs in a child process, so for every step the run reports
+session latencies, the CPU and memory used by the dashboard alone, and the
+rate of requests sent to the mock API.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+from threading import Barrier, Event, Thread
+import time
+
+import requests
+from streamlit.testing.v1 import AppTest
+
+from benchmark import LEAGUE_CODE, UNLIMITED_RATE, clear_caches, patch_api
+from cache import ANALYTICS_CACHE
+import extract
+from mock_api import REQUESTS_PATH
+from telemetry import get_percentile
+
+
+DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py')
+MOCK_API_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_api.py')
+
+SESSION_COUNTS = (1, 5, 10, 20, 40)
+
+# Seconds a session can take to render before it counts as failed.
+SESSION_TIMEOUT = 120.0
+
+# Seconds between samples of the process's memory.
+SAMPLE_INTERVAL = 0.1
+
+
+def get_memory() -> int:
+    """Returns the process's resident memory in bytes.
+
+    Reads /proc where it exists, and otherwise falls back to the peak
+    resident memory so far.
+    """
+
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceSampler:
+    """Measures the CPU time and peak memory of the process while in use."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.peak_memory = 0
+        self.cpu_seconds = 0.0
+        self._stopped = Event()
+        self._thread = None
+        self._cpu = 0.0
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak_memory = max(self.peak_memory, get_memory())
+
+    def __enter__(self) -> 'ResourceSampler':
+        self.peak_memory = get_memory()
+        self._cpu = time.process_time()
+        self._stopped.clear()
+        self._thread = Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.peak_memory = max(self.peak_memory, get_memory())
+        self.cpu_seconds = time.process_time() - self._cpu
+
+
+class MockAPIProcess:
+    """Runs the mock FPL API in a child process while in use."""
+
+    def __init__(self, managers: int, gameweeks: int, latency: float = 0.0) -> None:
+        self.args = ['--port', '0', '--managers', str(managers),
+                     '--gameweeks', str(gameweeks), '--latency', str(latency)]
+        self.base_url = None
+        self._process = None
+
+    @property
+    def requests(self) -> int:
+        """Returns the number of requests the mock API has served."""
+
+        root = self.base_url.removesuffix('/api')
+        return requests.get(f"{root}{REQUESTS_PATH}", timeout=10).json()['requests']
+
+    def __enter__(self) -> 'MockAPIProcess':
+        self._process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, MOCK_API_PATH, *self.args],
+            stdout=subprocess.PIPE, text=True)
+        self.base_url = self._process.stdout.readline().split()[-1]
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._process.terminate()
+        self._process.wait()
+        self._process.stdout.close()
+
+
+def run_session(barrier: Barrier, timeout: float) -> float | None:
+    """Opens a league in a new session and returns the seconds it took to render.
+
+    Returns None if the session timed out or the dashboard raised.
+    """
+
+    app = AppTest.from_file(DASHBOARD_PATH, default_timeout=timeout)
+    app.run()
+    app.sidebar.number_input[0].set_value(LEAGUE_CODE)
+    app.sidebar.button[0].click()
+
+    barrier.wait()
+    start = time.perf_counter()
+
+    try:
+        app.run()
+    except RuntimeError:
+        return None
+
+    return None if app.exception else time.perf_counter() - start
+
+
+def run_step(sessions: int, server, timeout: float = SESSION_TIMEOUT) -> dict:
+    """Returns the measurements for a number of sessions opened at once."""
+
+    clear_caches()
+    ANALYTICS_CACHE.clear()
+
+    barrier = Barrier(sessions)
+    sent = server.requests
+
+    with ResourceSampler() as sampler, \
+            ThreadPoolExecutor(sessions, thread_name_prefix='session') as executor:
+        start = time.perf_counter()
+        latencies = list(executor.map(
+            lambda _: run_session(barrier, timeout), range(sessions)))
+        seconds = time.perf_counter() - start
+
+    sent = server.requests - sent
+    completed = sorted(latency for latency in latencies if latency is not None)
+
+    return {'sessions': sessions,
+            'failed': sessions - len(completed),
+            'p50_seconds': get_percentile(completed, 0.5),
+            'p90_seconds': get_percentile(completed, 0.9),
+            'max_seconds': completed[-1] if completed else None,
+            'mean_seconds': statistics.fmean(completed) if completed else None,
+            'wall_seconds': seconds,
+            'cpu_cores': sampler.cpu_seconds / seconds,
+            'peak_memory_mb': sampler.peak_memory / 2 ** 20,
+            'requests': sent,
+            'requests_per_second': sent / seconds}
+
+
+def run_load_test(session_counts=SESSION_COUNTS, managers: int = 50,
+                  gameweeks: int = 38, latency: float = 0.05,
+                  rate: float | None = None) -> list[dict]:
+    """Returns the measurements for every step of the load test.
+
+    The fetch engine is limited to rate requests per second, or keeps its
+    own limit, as it would against the real API, if rate is None.
+    """
+
+    with MockAPIProcess(managers, gameweeks, latency) as server, \
+            patch_api(server.base_url, rate):
+        return [run_step(sessions, server) for sessions in session_counts]
+
+
+def format_value(value) -> str:
+    """Formats a measurement for the results table."""
+
+    if value is None:
+        return '-'
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def main() -> None:
+    """Runs the load test and prints a row for every step."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=SESSION_COUNTS)
+    parser.add_argument('--managers', type=int, default=50)
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the mock API delays every response by.')
+    parser.add_argument('--unthrottled', action='store_true',
+                        help="Lift the fetch engine's rate limit.")
+    parser.add_argument('--output', help='File to save the results to as JSON.')
+    args = parser.parse_args()
+
+    try:
+        results = run_load_test(args.sessions, args.managers, args.gameweeks,
+                                args.latency, UNLIMITED_RATE if args.unthrottled else None)
+    finally:
+        extract.ENGINE.close()
+
+    columns = list(results[0])
+    print(' '.join(f"{column:>19}" for column in columns))
+    for result in results:
+        print(' '.join(f"{format_value(result[column]):>19}" for column in columns))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""Local stand-in for the FPL API for repeatable performance testing.
+
+The server either generates a synthetic league of any size, or replays
+responses recorded from the real API. To record, run the dashboard with
+FPL_RECORD_PATH set to a directory. To replay, pass that directory with
+--fixtures. Point the dashboard at the server with FPL_API_URL, e.g.
+
+    python mock_api.py --managers 500 --latency 0.05
+    FPL_API_URL=http://127.0.0.1:8000/api streamlit run dashboard.py
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+from threading import Lock, Thread
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from fixtures import FixtureStore
+
+
+SEASON_GAMEWEEKS = 38
+SEASON_START = datetime(2024, 8, 16, 17, 30, tzinfo=timezone.utc)
+STANDINGS_PAGE_SIZE = 50
+SQUAD_SIZE = 15
+STARTERS = 11
+POSITIONS = {1: 'GKP', 2: 'DEF', 3: 'MID', 4: 'FWD'}
+
+# Path outside the API which reports how many requests have been served.
+REQUESTS_PATH = '/mock/requests'
+
+
+class SyntheticLeague:
+    """Generates a consistent season for a classic league of made-up managers.
+
+    Every document comes from a random generator seeded by what it describes,
+    such as a manager and gameweek, so any document can be generated on its
+    own and is the same every time. Managers have IDs 1 to managers, and
+    gameweeks up to the current one have been played.
+    """
+
+    def __init__(self, managers: int = 50, gameweeks: int = SEASON_GAMEWEEKS,
+                 players: int = 600, teams: int = 20, seed: int = 0,
+                 live: bool = False) -> None:
+        self.managers = managers
+        self.gameweeks = gameweeks
+        self.players = players
+        self.teams = teams
+        self.seed = seed
+        self.live = live
+        self._lock = Lock()
+        self._live_points = {}
+        self._updates = 0
+        self._totals = None
+        self._histories = {}
+
+    def _random(self, *key) -> random.Random:
+        """Returns a random generator seeded by the league seed and a key."""
+
+        return random.Random('-'.join(map(str, (self.seed, *key))))
+
+    def _get_live_stats(self, gw: int) -> tuple[list[int], list[int]]:
+        """Returns every player's points and minutes in a gameweek, indexed by ID - 1.
+
+        Players who didn't play score nothing.
+        """
+
+        with self._lock:
+            if gw not in self._live_points:
+                rng = self._random('live', gw)
+                points = [rng.choice((0, 1, 1, 2, 2, 2, 3, 5, 6, 8, 10, 13))
+                          for _ in range(self.players)]
+                rng = self._random('minutes', gw)
+                minutes = [0 if rng.random() < 0.15 else rng.choice((25, 60, 90, 90))
+                           for _ in range(self.players)]
+                self._live_points[gw] = (
+                    [point if played else 0 for point, played in zip(points, minutes)],
+                    minutes)
+            return self._live_points[gw]
+
+    def _get_live_points(self, gw: int) -> list[int]:
+        """Returns every player's points in a gameweek, indexed by ID - 1."""
+
+        return self._get_live_stats(gw)[0]
+
+    def update_live_points(self, changes: int = 10) -> None:
+        """Adds points for a few players in the current gameweek, as a live update would."""
+
+        points, minutes = self._get_live_stats(self.gameweeks)
+
+        with self._lock:
+            self._updates += 1
+            rng = self._random('update', self._updates)
+            for player in rng.sample(range(self.players), changes):
+                minutes[player] = max(minutes[player], 1)
+                points[player] += rng.choice((1, 2, 3, 6))
+            self._histories.clear()
+            self._totals = None
+
+    def _get_chips(self, manager_id: int) -> dict[int, str]:
+        """Returns the chip a manager played in each gameweek they played one."""
+
+        rng = self._random('chips', manager_id)
+        gameweeks = list(range(1, self.gameweeks + 1))
+        rng.shuffle(gameweeks)
+
+        chips = ['wildcard', 'bboost', '3xc', 'freehit', 'wildcard']
+        return {gw: chip for gw, chip in zip(gameweeks, chips)
+                if rng.random() < 0.8}
+
+    def _get_squad(self, manager_id: int, gw: int) -> list[int]:
+        """Returns the players a manager picked in a gameweek, captain first."""
+
+        return self._random('picks', manager_id, gw).sample(
+            range(1, self.players + 1), SQUAD_SIZE)
+
+    def _get_multipliers(self, chip: str | None) -> list[int]:
+        """Returns the multiplier of each squad position for a chip."""
+
+        captain = 3 if chip == '3xc' else 2
+        bench = 1 if chip == 'bboost' else 0
+
+        return [captain] + [1] * (STARTERS - 1) + [bench] * (SQUAD_SIZE - STARTERS)
+
+    def _get_scores(self, manager_id: int) -> list[tuple[int, int]]:
+        """Returns a manager's points and bench points for every gameweek."""
+
+        chips = self._get_chips(manager_id)
+        scores = []
+
+        for gw in range(1, self.gameweeks + 1):
+            live = self._get_live_points(gw)
+            points = [live[player - 1] for player in self._get_squad(manager_id, gw)]
+            multipliers = self._get_multipliers(chips.get(gw))
+            scores.append((
+                sum(point * multiplier for point, multiplier in zip(points, multipliers)),
+                sum(points[STARTERS:]) if multipliers[-1] == 0 else 0))
+
+        return scores
+
+    def _get_totals(self) -> list[tuple[int, int, int]]:
+        """Returns (total, latest points, manager ID) for every manager, best first."""
+
+        with self._lock:
+            totals = self._totals
+
+        if totals is None:
+            totals = []
+            for manager_id in range(1, self.managers + 1):
+                latest = self.history(manager_id)['current'][-1]
+                totals.append((latest['total_points'], latest['points'], manager_id))
+            totals.sort(key=lambda total: (-total[0], total[2]))
+
+            with self._lock:
+                self._totals = totals
+
+        return totals
+
+    def has_manager(self, manager_id: int) -> bool:
+        """Checks if a manager ID belongs to the league."""
+
+        return 1 <= manager_id <= self.managers
+
+    def bootstrap(self) -> dict:
+        """Returns the bootstrap-static document."""
+
+        rng = self._random('players')
+
+        events = [{'id': gw, 'name': f'Gameweek {gw}',
+                   'deadline_time': (SEASON_START + timedelta(weeks=gw - 1))
+                   .isoformat().replace('+00:00', 'Z'),
+                   'is_current': gw == self.gameweeks,
+                   'finished': gw < self.gameweeks or (
+                       gw == self.gameweeks and not self.live),
+                   'data_checked': gw < self.gameweeks or (
+                       gw == self.gameweeks and not self.live)}
+                  for gw in range(1, SEASON_GAMEWEEKS + 1)]
+
+        elements = [{'id': player_id, 'web_name': f'Player {player_id}',
+                     'team': (player_id - 1) % self.teams + 1,
+                     'element_type': rng.choice((1, 2, 2, 2, 3, 3, 3, 4)),
+                     'now_cost': rng.randrange(40, 140, 5)}
+                    for player_id in range(1, self.players + 1)]
+
+        return {'events': events, 'elements': elements,
+                'teams': [{'id': team, 'name': f'Team {team}',
+                           'short_name': f'T{team:02d}'}
+                          for team in range(1, self.teams + 1)],
+                'element_types': [{'id': element_type, 'singular_name_short': name}
+                                  for element_type, name in POSITIONS.items()]}
+
+    def standings(self, league_code: int, page: int) -> dict:
+        """Returns a page of the league's standings."""
+
+        totals = self._get_totals()
+        start = (page - 1) * STANDINGS_PAGE_SIZE
+
+        results = []
+        for position, (total, latest, manager_id) in enumerate(
+                totals[start:start + STANDINGS_PAGE_SIZE], start + 1):
+            rank = position if not results or results[-1]['total'] != total \
+                else results[-1]['rank']
+            results.append({'entry': manager_id, 'rank': rank, 'total': total,
+                            'event_total': latest,
+                            'player_name': f'Manager {manager_id}',
+                            'entry_name': f'Team {manager_id}'})
+
+        return {'league': {'id': league_code, 'name': f'Mock League {league_code}'},
+                'standings': {'has_next': start + STANDINGS_PAGE_SIZE < len(totals),
+                              'page': page, 'results': results}}
+
+    def entry(self, manager_id: int) -> dict:
+        """Returns a manager's entry document."""
+
+        history = self.history(manager_id)['current']
+
+        return {'id': manager_id, 'name': f'Team {manager_id}',
+                'summary_overall_points': history[-1]['total_points'],
+                'summary_overall_rank': history[-1]['overall_rank']}
+
+    def history(self, manager_id: int) -> dict:
+        """Returns a manager's season history document.
+
+        Each history is generated once, since the picks documents read their
+        gameweek's scores from it.
+        """
+
+        with self._lock:
+            history = self._histories.get(manager_id)
+
+        if history is None:
+            history = self._generate_history(manager_id)
+            with self._lock:
+                self._histories[manager_id] = history
+
+        return history
+
+    def _generate_history(self, manager_id: int) -> dict:
+        """Generates a manager's season history document from their scores."""
+
+        rng = self._random('history', manager_id)
+        rank = rng.randrange(1, 10_000_000)
+        total = 0
+        current = []
+
+        for gw, (points, bench) in enumerate(self._get_scores(manager_id), 1):
+            transfers = rng.choice((0, 1, 1, 2))
+            cost = 4 * max(0, transfers - 1)
+            total += points - cost
+            rank = max(1, int(rank * rng.uniform(0.7, 1.3)))
+            current.append({'event': gw, 'points': points, 'total_points': total,
+                            'overall_rank': rank, 'points_on_bench': bench,
+                            'event_transfers': transfers,
+                            'event_transfers_cost': cost})
+
+        chips = [{'name': chip, 'event': gw}
+                 for gw, chip in sorted(self._get_chips(manager_id).items())]
+
+        return {'current': current, 'chips': chips}
+
+    def picks(self, manager_id: int, gw: int) -> dict:
+        """Returns a manager's picks document for a gameweek."""
+
+        chip = self._get_chips(manager_id).get(gw)
+        squad = self._get_squad(manager_id, gw)
+        multipliers = self._get_multipliers(chip)
+        history = self.history(manager_id)['current'][gw - 1]
+
+        return {'active_chip': chip,
+                'entry_history': {key: history[key] for key in (
+                    'points', 'total_points', 'event_transfers_cost')},
+                'picks': [{'element': player, 'position': position,
+                           'multiplier': multiplier,
+                           'is_captain': position == 1,
+                           'is_vice_captain': position == 2}
+                          for position, (player, multiplier)
+                          in enumerate(zip(squad, multipliers), 1)]}
+
+    def live_points(self, gw: int) -> dict:
+        """Returns the live document for a gameweek."""
+
+        points, minutes = self._get_live_stats(gw)
+
+        with self._lock:
+            return {'elements': [{'id': player_id,
+                                  'stats': {'total_points': player_points,
+                                            'minutes': player_minutes}}
+                                 for player_id, (player_points, player_minutes)
+                                 in enumerate(zip(points, minutes), 1)]}
+
+    def fixtures(self, gw: int) -> list[dict]:
+        """Returns the fixtures of a gameweek, with every team playing once."""
+
+        teams = list(range(1, self.teams + 1))
+        self._random('fixtures', gw).shuffle(teams)
+        kickoff = SEASON_START + timedelta(weeks=gw - 1)
+        finished = gw < self.gameweeks or not self.live
+
+        return [{'id': (gw - 1) * self.teams // 2 + number, 'event': gw,
+                 'team_h': home, 'team_a': away,
+                 'kickoff_time': (kickoff + timedelta(hours=2 * (number % 3)))
+                 .isoformat().replace('+00:00', 'Z'),
+                 'started': True, 'finished': finished,
+                 'finished_provisional': finished}
+                for number, (home, away) in enumerate(zip(teams[::2], teams[1::2]), 1)]
+
+
+class MockFPLServer(ThreadingHTTPServer):
+    """HTTP server which answers FPL API requests from a synthetic league.
+
+    With fixtures, responses recorded from the real API are replayed instead,
+    and anything which wasn't recorded is a 404. Every response can be
+    delayed by latency seconds, and a share of requests given by error_rate
+    fail with one of error_statuses.
+    """
+
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self, league: SyntheticLeague | None = None,
+                 fixtures: FixtureStore | None = None,
+                 address: tuple[str, int] = ('127.0.0.1', 0), *,
+                 latency: float = 0.0, error_rate: float = 0.0,
+                 error_statuses: tuple[int, ...] = (429, 503),
+                 seed: int = 0) -> None:
+        super().__init__(address, MockFPLHandler)
+        self.league = league or SyntheticLeague()
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._routes = [
+            (r'/api/bootstrap-static', lambda _match, _query: self.league.bootstrap()),
+            (r'/api/leagues-classic/(\d+)/standings', self._standings),
+            (r'/api/entry/(\d+)', self._manager(self.league.entry)),
+            (r'/api/entry/(\d+)/history', self._manager(self.league.history)),
+            (r'/api/entry/(\d+)/event/(\d+)/picks', self._picks),
+            (r'/api/event/(\d+)/live', self._live),
+            (r'/api/fixtures', self._fixtures)]
+
+    @property
+    def base_url(self) -> str:
+        """Returns the URL to set FPL_API_URL to."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def _standings(self, match: re.Match, query: dict) -> dict:
+        page = int(query.get('page_standings', ['1'])[0])
+        return self.league.standings(int(match[1]), page)
+
+    def _manager(self, document):
+        def route(match: re.Match, _query: dict) -> dict | None:
+            manager_id = int(match[1])
+            return document(manager_id) if self.league.has_manager(manager_id) else None
+        return route
+
+    def _picks(self, match: re.Match, _query: dict) -> dict | None:
+        manager_id, gw = int(match[1]), int(match[2])
+        if not self.league.has_manager(manager_id) or gw > self.league.gameweeks:
+            return None
+        return self.league.picks(manager_id, gw)
+
+    def _live(self, match: re.Match, _query: dict) -> dict | None:
+        gw = int(match[1])
+        return self.league.live_points(gw) if gw <= self.league.gameweeks else None
+
+    def _fixtures(self, _match: re.Match, query: dict) -> list[dict] | None:
+        gw = int(query.get('event', ['0'])[0])
+        return self.league.fixtures(gw) if 1 <= gw <= self.league.gameweeks else None
+
+    def get_document(self, path: str) -> dict | None:
+        """Returns the document for a request path, or None if there isn't one."""
+
+        if self.fixtures is not None:
+            return self.fixtures.load(path)
+
+        parts = urlsplit(path)
+
+        for pattern, route in self._routes:
+            match = re.fullmatch(f'{pattern}/?', parts.path)
+            if match:
+                return route(match, parse_qs(parts.query))
+        return None
+
+    def get_failure(self) -> int | None:
+        """Returns an error status to inject into a response, or None."""
+
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.error_rate:
+                return self._random.choice(self.error_statuses)
+        return None
+
+
+class MockFPLHandler(BaseHTTPRequestHandler):
+    """Answers a request from the mock server's league or fixtures."""
+
+    def do_GET(self) -> None:
+        """Responds with the document for the path, an injected error, or a 404.
+
+        REQUESTS_PATH answers with the number of requests served so far,
+        without counting itself, for load tests running the server in
+        another process.
+        """
+        server = self.server
+
+        if self.path == REQUESTS_PATH:
+            body = json.dumps({'requests': server.requests}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        time.sleep(server.latency)
+
+        status = server.get_failure()
+        document = None if status else server.get_document(self.path)
+
+        if status is None:
+            status = 200 if document is not None else 404
+
+        body = json.dumps(document if status == 200 else {'detail': 'Not found.'}).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+
+        self.send_response(status)
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        """Silences the default request logging."""
+
+
+def main() -> None:
+    """Runs the mock API until it is interrupted."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--managers', type=int, default=50)
+    parser.add_argument('--gameweeks', type=int, default=SEASON_GAMEWEEKS)
+    parser.add_argument('--live', action='store_true',
+                        help='Leave the current gameweek unfinished.')
+    parser.add_argument('--live-updates', type=float,
+                        help='Seconds between live score updates, with --live.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to delay every response by.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests to fail with a 429 or 503.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures',
+                        help='Directory of recorded responses to replay.')
+    args = parser.parse_args()
+
+    server = MockFPLServer(
+        SyntheticLeague(args.managers, args.gameweeks, seed=args.seed,
+                        live=args.live),
+        FixtureStore(args.fixtures) if args.fixtures else None,
+        (args.host, args.port), latency=args.latency,
+        error_rate=args.error_rate, seed=args.seed)
+
+    if args.live and args.live_updates:
+        def update_scores():
+            while True:
+                time.sleep(args.live_updates)
+                server.league.update_live_points()
+
+        Thread(target=update_scores, daemon=True).start()
+
+    print(f"Serving the mock FPL API at {server.base_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Opt-in CPU and allocation profiling of the dashboard's tabs.
+
+Set FPL_PROFILE_PATH to a directory, or turn on profiling in the sidebar,
+and every tab's data load and chart render runs under cProfile and
+tracemalloc. Each one saves a .prof file for pstats or snakeviz and a text
+report of the slowest functions and largest allocations, named after the
+tab, the league size and the gameweek.
+
+Only the thread running a section is profiled, so requests and JSON parsing
+on the fetch engine's thread show up as time spent waiting. Profiled
+sections run one at a time, since tracemalloc traces the whole process.
+"""
+
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+import io
+import logging
+import os
+import pstats
+from threading import Lock
+import time
+import tracemalloc
+
+
+# Directory every session saves profiles to, if set.
+PROFILE_PATH = os.environ.get('FPL_PROFILE_PATH')
+
+# Directory used when profiling is turned on in the sidebar instead.
+DEFAULT_PROFILE_PATH = 'profiles'
+
+# Functions and allocation sites listed in each report.
+REPORT_LINES = 30
+
+PROFILE_LOCK = Lock()
+
+
+def get_profile_name(tab: str, stage: str, managers: int, gameweek: int) -> str:
+    """Returns the file name, without an extension, for a section's profile."""
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return f"{stamp}-{tab}-{stage}-{managers}managers-gw{gameweek}"
+
+
+def get_report(profiler: cProfile.Profile, allocations: list, header: str) -> str:
+    """Returns a report of the slowest functions and largest allocations."""
+
+    stream = io.StringIO()
+    stream.write(f"{header}\n\nSlowest functions by cumulative time\n")
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(REPORT_LINES)
+
+    stream.write("Largest allocations by line\n")
+    for stat in allocations[:REPORT_LINES]:
+        stream.write(f"{stat}\n")
+
+    return stream.getvalue()
+
+
+@contextmanager
+def profile_section(path: str, tab: str, stage: str, managers: int, gameweek: int):
+    """Profiles the block and saves its reports to a directory.
+
+    Yields the path the reports are saved to, without an extension.
+    """
+
+    os.makedirs(path, exist_ok=True)
+    name = os.path.join(path, get_profile_name(tab, stage, managers, gameweek))
+
+    with PROFILE_LOCK:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+
+        try:
+            yield name
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+
+            _, peak = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            ).compare_to(before, 'lineno')
+            if not tracing:
+                tracemalloc.stop()
+
+            header = (f"Tab: {tab} ({stage})\nManagers: {managers}\n"
+                      f"Gameweek: {gameweek}\nSeconds: {seconds:.3f}\n"
+                      f"Peak traced memory: {peak} bytes")
+
+            profiler.dump_stats(f"{name}.prof")
+            with open(f"{name}.txt", 'w', encoding='utf-8') as report:
+                report.write(get_report(profiler, allocations, header))
+
+            logging.info(f'Profiled {tab} {stage} in {seconds}s: {name}.txt')
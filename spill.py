@@ -0,0 +1,157 @@
+"""Spills large datasets to partitioned Parquet files to be scanned lazily."""
+
+from collections import defaultdict
+from hashlib import sha1
+import os
+import shutil
+import tempfile
+from threading import Lock
+import time
+import uuid
+
+import polars as pl
+
+
+SPILL_PATH = os.environ.get(
+    'FPL_SPILL_PATH', os.path.join(tempfile.gettempdir(), 'fpl_spill'))
+
+# Seconds an old version of a dataset is kept after a newer one replaces it,
+# so scans of it that are still being collected can finish.
+SUPERSEDED_RETENTION = 600
+
+# Seconds a dataset is kept after it was last written or scanned.
+MAX_DATASET_AGE = 24 * 3600
+
+
+class ParquetSpill:
+    """Writes datasets to disk a batch at a time so they never sit in memory whole.
+
+    A dataset is identified by a key and made up of one or more tables. Each
+    table is a directory with one Parquet file per batch. A dataset is only
+    written once while it is fresh. Every write makes a new version in its
+    own directory, moved into place once it is complete, so readers never see
+    a dataset which is partly written or being replaced.
+
+    Old versions are deleted SUPERSEDED_RETENTION seconds after they are
+    replaced, and whole datasets once nobody has used them for
+    MAX_DATASET_AGE seconds.
+    """
+
+    def __init__(self, path: str = SPILL_PATH, clock=time.time) -> None:
+        self.path = path
+        self._clock = clock
+        self._locks = defaultdict(Lock)
+        self._locks_lock = Lock()
+        self._used_at = {}
+
+    def _directory(self, key: tuple) -> str:
+        """Returns the directory a dataset's versions are written to."""
+
+        return os.path.join(self.path, sha1(repr(key).encode()).hexdigest())
+
+    def _lock(self, directory: str) -> Lock:
+        """Returns the lock held while a dataset is written or pruned."""
+
+        with self._locks_lock:
+            return self._locks[directory]
+
+    @staticmethod
+    def _versions(directory: str) -> list[tuple[float, str]]:
+        """Returns (written at, directory) for each complete version of a dataset, oldest first."""
+
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted((int(name.split('-')[1]) / 1000, os.path.join(directory, name))
+                      for name in names if name.startswith('v-'))
+
+    def _write(self, directory: str, batches, schemas: dict) -> str:
+        """Writes every batch of a dataset as a new version, and returns its directory."""
+
+        staging = os.path.join(directory, f"staging-{uuid.uuid4().hex}")
+
+        try:
+            for table in schemas:
+                os.makedirs(os.path.join(staging, table))
+
+            for number, batch in enumerate(batches):
+                for table, frame in batch.items():
+                    frame.write_parquet(os.path.join(
+                        staging, table, f"batch-{number:05d}.parquet"))
+
+            for table, schema in schemas.items():
+                if not os.listdir(os.path.join(staging, table)):
+                    pl.DataFrame(schema=schema).write_parquet(
+                        os.path.join(staging, table, 'batch-00000.parquet'))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        version = os.path.join(
+            directory, f"v-{round(self._clock() * 1000):015d}-{uuid.uuid4().hex[:8]}")
+        os.replace(staging, version)
+
+        return version
+
+    def scan(self, key: tuple, table: str, batches, schemas: dict,
+             ttl: float | None = None) -> pl.LazyFrame:
+        """Returns a lazy scan of one table of a dataset.
+
+        If the dataset hasn't been written yet, or is older than ttl seconds,
+        batches is called and must return an iterable of {table: frame}
+        dictionaries to write. Schemas maps every table to its schema.
+        """
+
+        directory = self._directory(key)
+        now = self._clock()
+
+        with self._lock(directory):
+            versions = self._versions(directory)
+            written = not versions or (ttl is not None and now - versions[-1][0] >= ttl)
+            version = self._write(directory, batches(), schemas) if written \
+                else versions[-1][1]
+            self._used_at[directory] = now
+
+        if written:
+            self.prune()
+
+        return pl.scan_parquet(os.path.join(version, table, '*.parquet'),
+                               schema=schemas[table])
+
+    def prune(self) -> None:
+        """Deletes replaced versions and unused datasets which are past their retention."""
+
+        now = self._clock()
+
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            directory = os.path.join(self.path, name)
+
+            with self._lock(directory):
+                versions = self._versions(directory)
+                used_at = max(self._used_at.get(directory, 0.0),
+                              versions[-1][0] if versions else 0.0)
+
+                if now - used_at > MAX_DATASET_AGE:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    self._used_at.pop(directory, None)
+                    continue
+
+                for (_, path), (replaced_at, _) in zip(versions, versions[1:]):
+                    if now - replaced_at > SUPERSEDED_RETENTION:
+                        shutil.rmtree(path, ignore_errors=True)
+
+    def clear(self) -> None:
+        """Deletes every dataset written to disk."""
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._used_at.clear()
+
+
+SPILL = ParquetSpill()
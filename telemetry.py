@@ -0,0 +1,180 @@
+"""Records request telemetry for the FPL API, grouped by dashboard tab."""
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import math
+import os
+import re
+from threading import Lock
+import time
+from urllib.parse import urlsplit
+
+
+# File the dashboard appends the telemetry to after each run, if set.
+TELEMETRY_PATH = os.environ.get('FPL_TELEMETRY_PATH')
+
+# Latencies kept per tab and endpoint for the percentiles.
+MAX_SAMPLES = 10000
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+CURRENT_TAB = ContextVar('current_tab', default='other')
+
+
+def get_endpoint(url: str) -> str:
+    """Returns the endpoint template of a URL, with its IDs replaced."""
+
+    return re.sub(r'/\d+(?=/|$)', '/{id}', urlsplit(url).path)
+
+
+def get_percentile(samples: list[float], percentile: float) -> float | None:
+    """Returns a nearest-rank percentile of a list of samples."""
+
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percentile * len(ordered)) - 1)]
+
+
+def get_current_tab() -> str:
+    """Returns the tab that requests are currently being made for."""
+
+    return CURRENT_TAB.get()
+
+
+@contextmanager
+def tab_context(name: str):
+    """Attributes every request made inside the block to a tab."""
+
+    token = CURRENT_TAB.set(name)
+    try:
+        yield
+    finally:
+        CURRENT_TAB.reset(token)
+
+
+class Telemetry:
+    """Collects per-endpoint request statistics, grouped by tab.
+
+    Every attempt at a request is recorded with its status, latency and
+    response size, along with whether it was a retry. Document store lookups
+    are recorded as cache hits and misses against the same endpoint.
+    """
+
+    def __init__(self, max_samples: int = MAX_SAMPLES, clock=time.time) -> None:
+        self.max_samples = max_samples
+        self._clock = clock
+        self._lock = Lock()
+        self._stats = {}
+
+    def _entry(self, tab: str, endpoint: str) -> dict:
+        """Returns the statistics for a tab and endpoint, creating them if needed."""
+
+        key = (tab, endpoint)
+
+        if key not in self._stats:
+            self._stats[key] = {
+                'requests': 0, 'errors': 0, 'retries': 0, 'throttled': 0,
+                'bytes': 0, 'cache_hits': 0, 'cache_misses': 0,
+                'statuses': defaultdict(int),
+                'latencies': deque(maxlen=self.max_samples)}
+        return self._stats[key]
+
+    def record_request(self, url: str, status: int | None, latency: float,
+                       size: int, *, retry: bool = False,
+                       tab: str | None = None) -> None:
+        """Records one attempt at a request."""
+
+        with self._lock:
+            entry = self._entry(tab or get_current_tab(), get_endpoint(url))
+            entry['requests'] += 1
+            entry['statuses'][status or 'connection'] += 1
+            entry['latencies'].append(latency)
+            entry['bytes'] += size
+            entry['retries'] += retry
+            entry['errors'] += status not in (200, 304)
+            entry['throttled'] += status == 429
+
+    def record_cache(self, url: str, hits: int, misses: int) -> None:
+        """Records document store lookups for an endpoint."""
+
+        with self._lock:
+            entry = self._entry(get_current_tab(), get_endpoint(url))
+            entry['cache_hits'] += hits
+            entry['cache_misses'] += misses
+
+    def snapshot(self) -> list[dict]:
+        """Returns one row of statistics for each tab and endpoint."""
+
+        with self._lock:
+            rows = []
+            for (tab, endpoint), entry in sorted(self._stats.items()):
+                latencies = list(entry['latencies'])
+                rows.append({
+                    'tab': tab, 'endpoint': endpoint,
+                    **{name: entry[name] for name in (
+                        'requests', 'errors', 'retries', 'throttled', 'bytes',
+                        'cache_hits', 'cache_misses')},
+                    **{f'p{round(percentile * 100)}_seconds':
+                       get_percentile(latencies, percentile)
+                       for percentile in PERCENTILES},
+                    'statuses': {str(status): count
+                                 for status, count in entry['statuses'].items()}})
+            return rows
+
+    def to_json_lines(self) -> str:
+        """Returns the statistics as JSON lines, one per tab and endpoint."""
+
+        timestamp = self._clock()
+
+        return ''.join(json.dumps({'timestamp': timestamp, **row}) + '\n'
+                       for row in self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """Returns the statistics in the Prometheus text exposition format."""
+
+        counters = {'requests': 'fpl_api_requests_total',
+                    'errors': 'fpl_api_errors_total',
+                    'retries': 'fpl_api_retries_total',
+                    'throttled': 'fpl_api_throttled_total',
+                    'bytes': 'fpl_api_response_bytes_total',
+                    'cache_hits': 'fpl_api_cache_hits_total',
+                    'cache_misses': 'fpl_api_cache_misses_total'}
+
+        rows = self.snapshot()
+        lines = []
+
+        for column, metric in counters.items():
+            lines.append(f'# TYPE {metric} counter')
+            lines += [f'{metric}{{tab="{row["tab"]}",endpoint="{row["endpoint"]}"}} '
+                      f'{row[column]}' for row in rows]
+
+        lines.append('# TYPE fpl_api_latency_seconds summary')
+        for row in rows:
+            for percentile in PERCENTILES:
+                value = row[f'p{round(percentile * 100)}_seconds']
+                if value is not None:
+                    lines.append(
+                        f'fpl_api_latency_seconds{{tab="{row["tab"]}",'
+                        f'endpoint="{row["endpoint"]}",quantile="{percentile}"}} '
+                        f'{value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_json_lines(self, path: str) -> None:
+        """Appends the current statistics to a JSON lines file."""
+
+        with open(path, 'a', encoding='utf-8') as file:
+            file.write(self.to_json_lines())
+
+    def clear(self) -> None:
+        """Removes every recorded statistic."""
+
+        with self._lock:
+            self._stats.clear()
+
+
+TELEMETRY = Telemetry()
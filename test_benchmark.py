@@ -0,0 +1,34 @@
+"""Unit tests for the benchmark suite."""
+
+from benchmark import compare, run_benchmarks
+
+
+BASELINE = {'seconds': 1.0, 'requests': 100, 'peak_bytes': 10 ** 7,
+            'allocated_blocks': 1000}
+
+
+def test_compare_fails_doubled_requests():
+    """Tests a function making twice its baseline requests is a regression."""
+    results = {'get_rankings[5x5]': {**BASELINE, 'requests': 200},
+               'get_rankings[20x5]': {**BASELINE, 'requests': 105}}
+
+    regressions = compare(results, {'get_rankings[5x5]': BASELINE,
+                                    'get_rankings[20x5]': BASELINE})
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith('get_rankings[5x5]: requests 200')
+
+
+def test_compare_skips_benchmarks_without_baselines():
+    """Tests new benchmarks pass until a baseline is recorded for them."""
+    assert not compare({'get_rankings[5x5]': BASELINE}, {})
+
+
+def test_run_benchmarks_counts_requests():
+    """Tests a cold run's requests are counted against the mock API."""
+    results = run_benchmarks((5,), (2,), ('get_league_chip_data',
+                                          'get_league_captain_picks'))
+
+    assert results['get_league_chip_data[5x2]']['requests'] == 5 + 1
+    assert results['get_league_captain_picks[5x2]']['requests'] == 5 * 2 + 2 + 1
+    assert results['get_league_chip_data[5x2]']['peak_bytes'] > 0
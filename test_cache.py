@@ -0,0 +1,124 @@
+"""Unit tests for the shared analytics cache."""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+
+import polars as pl
+import pytest
+
+from cache import AnalyticsCache, get_size
+
+
+def test_concurrent_requests_are_computed_once():
+    """Tests simultaneous requests for a key share one computation."""
+    cache = AnalyticsCache()
+    release = Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(timeout=5)
+        return pl.DataFrame({'a': [1]})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(cache.get_or_compute, ('tab', 1, 1), compute)
+                   for _ in range(8)]
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result.equals(results[0]) for result in results)
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Tests the oldest entry is dropped once the memory limit is reached."""
+    frame = pl.DataFrame({'a': list(range(100))})
+    cache = AnalyticsCache(max_bytes=frame.estimated_size() * 2)
+
+    cache.get_or_compute(('tab', 1, 1), lambda: frame)
+    cache.get_or_compute(('tab', 2, 1), lambda: frame)
+    cache.get_or_compute(('tab', 1, 1), lambda: frame)
+    cache.get_or_compute(('tab', 3, 1), lambda: frame)
+
+    calls = []
+    cache.get_or_compute(('tab', 1, 1), lambda: calls.append(1))
+    cache.get_or_compute(('tab', 2, 1), lambda: calls.append(2))
+
+    assert calls == [2]
+
+
+def test_documents_count_everything_they_hold():
+    """Tests a large standings document counts towards the memory limit in full."""
+    standings = {'standings': {'results': [
+        {'entry': entry, 'player_name': f'Manager {entry}'} for entry in range(5000)]}}
+    cache = AnalyticsCache(max_bytes=100_000)
+
+    cache.get_or_compute(('standings', 1), lambda: standings)
+
+    assert get_size(standings) > 100_000
+    assert cache.stats()['entries'] == 0
+
+
+def test_entries_expire_after_ttl():
+    """Tests an entry with a time to live is recomputed once it expires."""
+    now = [0.0]
+    cache = AnalyticsCache(clock=lambda: now[0])
+
+    cache.get_or_compute(('tab', 1, 1), lambda: 1, ttl=10)
+    now[0] = 11.0
+
+    assert cache.get_or_compute(('tab', 1, 1), lambda: 2, ttl=10) == 2
+
+
+def test_failed_computation_is_not_cached():
+    """Tests an error is raised to the caller and the key can be retried."""
+    cache = AnalyticsCache()
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute(('tab', 1, 1), lambda: int('x'))
+
+    assert cache.get_or_compute(('tab', 1, 1), lambda: 3) == 3
+
+
+def test_stale_entry_is_served_while_it_refreshes():
+    """Tests an expired entry is returned with its age and refreshed in the background."""
+    now = [0.0]
+    cache = AnalyticsCache(clock=lambda: now[0])
+    release = Event()
+
+    def compute():
+        release.wait(timeout=5)
+        return 2
+
+    assert cache.get_or_revalidate(('tab', 1, 1), lambda: 1, ttl=10) == (1, None)
+    now[0] = 25.0
+
+    assert cache.get_or_revalidate(('tab', 1, 1), compute, ttl=10) == (1, 25.0)
+    assert cache.get_or_revalidate(('tab', 1, 1), compute, ttl=10) == (1, 25.0)
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.get_or_revalidate(('tab', 1, 1), compute, ttl=10)[1] is not None \
+            and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert cache.get_or_revalidate(('tab', 1, 1), compute, ttl=10) == (2, None)
+
+
+def test_stale_entry_is_kept_when_refresh_fails():
+    """Tests a failed refresh leaves the stale value to be served again."""
+    now = [0.0]
+    cache = AnalyticsCache(clock=lambda: now[0])
+    cache.get_or_compute(('tab', 1, 1), lambda: 1, ttl=10)
+    now[0] = 25.0
+
+    cache.get_or_revalidate(('tab', 1, 1), lambda: int('x'), ttl=10)
+    deadline = time.monotonic() + 5
+    while cache._in_flight and time.monotonic() < deadline:  # pylint: disable=protected-access
+        time.sleep(0.01)
+
+    assert cache.get_or_revalidate(('tab', 1, 1), lambda: int('x'), ttl=10) == (1, 25.0)
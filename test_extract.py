@@ -1,9 +1,485 @@
 """Unit tests for the extract script."""
 
-from extract import get_league_name
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+import pytest
+from requests.exceptions import RequestException
+
+from archive import GameweekArchive
+import extract
+from extract import (get_league_name,
+                     get_rankings,
+                     get_league_captain_picks,
+                     get_raw_league_data,
+                     select_managers,
+                     is_valid_code,
+                     get_season_league_rankings,
+                     get_league_chip_data,
+                     get_points_average_data,
+                     get_bootstrap_expiry,
+                     PicksStore,
+                     LivePointsStore,
+                     HistoryStore,
+                     BootstrapCache,
+                     PlayerIndex,
+                     UNSETTLED_RECHECK)
+from spill import ParquetSpill
+
+
+BOOTSTRAP_LOOKUPS = {
+    'teams': [{'id': 12, 'short_name': 'LIV'}, {'id': 13, 'short_name': 'MCI'}],
+    'element_types': [{'id': 3, 'singular_name_short': 'MID'},
+                      {'id': 4, 'singular_name_short': 'FWD'}]}
 
 
 def test_get_league_name():
     """Tests the correct league name is returned."""
     raw_data = {'league': {'name': "test name"}, 'other': 'test'}
     assert get_league_name(raw_data) == "test name"
+
+
+def test_picks_store_fetches_each_pair_once(stub_api):
+    """Tests repeated picks lookups are served from the store."""
+    for gw in (1, 2):
+        stub_api.routes[f'/api/entry/1/event/{gw}/picks'] = {'picks': []}
+    store = PicksStore()
+
+    store.get(1, 1)
+    store.get(1, 1)
+    store.get(1, 2)
+
+    assert len(stub_api.paths) == 2
+    assert store.stats() == {'hits': 1, 'misses': 2, 'coalesced': 0,
+                             'archived': 0, 'size': 2}
+
+
+def test_picks_store_coalesces_concurrent_requests(stub_api):
+    """Tests tabs asking for the same documents at once share one download each."""
+    keys = [(manager_id, 1) for manager_id in range(1, 6)]
+    for manager_id, gw in keys:
+        stub_api.routes[f'/api/entry/{manager_id}/event/{gw}/picks'] = {
+            'picks': [{'element': manager_id}]}
+    stub_api.delay = 0.2
+    store = PicksStore()
+
+    with ThreadPoolExecutor(5) as executor:
+        results = list(executor.map(lambda _: store.get_many(keys), range(5)))
+
+    assert len(stub_api.paths) == 5
+    assert all(result == results[0] for result in results)
+    assert store.stats()['misses'] == 5
+
+
+def test_live_points_store_tables_player_scores(stub_api):
+    """Tests a gameweek's player scores are tabled from a single live download."""
+    stub_api.routes['/api/event/3/live'] = {'elements': [
+        {'id': 1, 'stats': {'total_points': 2}},
+        {'id': 7, 'stats': {'total_points': 12}}]}
+    store = LivePointsStore()
+
+    assert store.get(3)['id'].to_list() == [1, 7]
+    assert store.get(3)['player_score'].to_list() == [2, 12]
+    assert len(stub_api.paths) == 1
+
+
+def test_bootstrap_expiry_waits_for_next_deadline_when_settled():
+    """Tests a settled gameweek keeps the payload until the next deadline."""
+    events = [
+        {'id': 1, 'deadline_time': '2024-08-16T17:30:00Z', 'is_current': True,
+         'finished': True, 'data_checked': True},
+        {'id': 2, 'deadline_time': '2024-08-24T10:00:00Z', 'is_current': False,
+         'finished': False, 'data_checked': False}]
+    now = 1723900000.0
+
+    assert get_bootstrap_expiry(events, now) == 1724493600.0
+
+
+def test_bootstrap_expiry_rechecks_unsettled_gameweek():
+    """Tests an unfinished gameweek is re-checked before the next deadline."""
+    events = [
+        {'id': 1, 'deadline_time': '2024-08-16T17:30:00Z', 'is_current': True,
+         'finished': False, 'data_checked': False},
+        {'id': 2, 'deadline_time': '2024-08-24T10:00:00Z', 'is_current': False,
+         'finished': False, 'data_checked': False}]
+    now = 1723900000.0
+
+    assert get_bootstrap_expiry(events, now) == now + UNSETTLED_RECHECK
+
+
+def test_bootstrap_cache_parses_payload_once(stub_api):
+    """Tests the current gameweek and players share one download."""
+    stub_api.routes['/api/bootstrap-static/'] = {
+        'events': [{'id': 1, 'deadline_time': '2024-08-16T17:30:00Z',
+                    'is_current': True, 'finished': True, 'data_checked': True}],
+        'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130, 'form': '5.0'}],
+        **BOOTSTRAP_LOOKUPS}
+    cache = BootstrapCache(clock=lambda: 1723900000.0)
+
+    assert cache.get_current_gameweek() == 1
+    assert cache.get_players()['web_name'].to_list() == ['Salah']
+    assert len(stub_api.paths) == 1
+
+
+def test_bootstrap_cache_serves_stale_payload_while_api_is_down(stub_api, monkeypatch):
+    """Tests an expired payload is kept, and not refetched, while the API fails."""
+    monkeypatch.setattr(extract.ENGINE, 'max_attempts', 1)
+    stub_api.routes['/api/bootstrap-static/'] = {
+        'events': [{'id': 1, 'deadline_time': '2024-08-16T17:30:00Z',
+                    'is_current': True, 'finished': False, 'data_checked': False}],
+        'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130}],
+        **BOOTSTRAP_LOOKUPS}
+    now = [1723900000.0]
+    cache = BootstrapCache(clock=lambda: now[0])
+    cache.get_current_gameweek()
+
+    now[0] += UNSETTLED_RECHECK + 1
+    stub_api.failures['/api/bootstrap-static/'] = [503]
+
+    assert cache.get_current_gameweek() == 1
+    assert cache.get_current_gameweek() == 1
+    assert len(stub_api.paths) == 2
+
+
+def history_row(event: int, points: int, total_points: int) -> dict:
+    """Returns a gameweek row as found in a manager's history."""
+    return {'event': event, 'points': points, 'total_points': total_points,
+            'overall_rank': 1000, 'points_on_bench': 0,
+            'event_transfers': 0, 'event_transfers_cost': 0}
+
+
+SEASON_START = datetime(2024, 8, 16, 17, 30, tzinfo=timezone.utc)
+
+
+def bootstrap(current: int, settled: bool = True) -> dict:
+    """Returns a bootstrap-static payload whose current gameweek is current."""
+    return {'events': [{'id': gw, 'deadline_time': (SEASON_START + timedelta(weeks=gw - 1))
+                        .isoformat(),
+                        'is_current': gw == current,
+                        'finished': gw < current or settled,
+                        'data_checked': gw < current or settled}
+                       for gw in range(1, current + 2)],
+            'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                          'element_type': 3, 'now_cost': 130}],
+            **BOOTSTRAP_LOOKUPS}
+
+
+MANAGER_DATA = pl.DataFrame({'manager_id': [1, 2, 3],
+                             'player_name': ['A', 'B', 'C'],
+                             'entry_name': ['a', 'b', 'c']})
+
+
+def test_season_league_rankings_share_tied_ranks(stub_api):
+    """Tests managers level on points share a league rank."""
+    stub_api.routes['/api/bootstrap-static/'] = bootstrap(2)
+    stub_api.routes.update({
+        '/api/entry/1/history': {
+            'current': [history_row(1, 60, 60), history_row(2, 50, 110)],
+            'chips': []},
+        '/api/entry/2/history': {
+            'current': [history_row(1, 60, 60), history_row(2, 70, 130)],
+            'chips': []},
+        '/api/entry/3/history': {
+            'current': [history_row(1, 70, 70), history_row(2, 30, 100)],
+            'chips': []}})
+
+    rankings = get_season_league_rankings(MANAGER_DATA).sort(
+        'gameweek', 'manager_id')
+
+    assert rankings['rank'].to_list() == [2, 2, 1, 2, 1, 3]
+
+
+def test_points_average_data_is_per_manager(stub_api):
+    """Tests the running average only uses each manager's own scores."""
+    stub_api.routes['/api/bootstrap-static/'] = bootstrap(2)
+    stub_api.routes.update({
+        '/api/entry/1/history': {
+            'current': [history_row(1, 60, 60), history_row(2, 40, 100)],
+            'chips': []},
+        '/api/entry/2/history': {
+            'current': [history_row(1, 80, 80), history_row(2, 20, 100)],
+            'chips': []},
+        '/api/entry/3/history': {
+            'current': [history_row(1, 10, 10), history_row(2, 30, 40)],
+            'chips': []}})
+
+    averages = get_points_average_data(MANAGER_DATA)
+
+    assert averages['Points'].to_list() == [60, 50, 80, 50, 10, 20]
+
+
+def test_league_chip_data_names_chips(stub_api):
+    """Tests chips are renamed and wildcards split by half of the season."""
+    stub_api.routes['/api/bootstrap-static/'] = bootstrap(30)
+    stub_api.routes['/api/entry/1/history'] = {
+        'current': [history_row(3, 50, 50),
+                    history_row(25, 70, 1200),
+                    history_row(30, 90, 1500)],
+        'chips': [{'name': 'wildcard', 'event': 3},
+                  {'name': 'wildcard', 'event': 25},
+                  {'name': '3xc', 'event': 30}]}
+
+    chip_data = get_league_chip_data(MANAGER_DATA.head(1))
+
+    assert chip_data['chip'].to_list() == [
+        'Wildcard 1', 'Wildcard 2', 'Triple Captain']
+    assert chip_data['points'].to_list() == [50, 70, 90]
+
+
+def test_history_store_refreshes_when_the_gameweek_moves_on(stub_api, tmp_path):
+    """Tests a history finalized in one gameweek is downloaded again in the next."""
+    stub_api.routes['/api/bootstrap-static/'] = bootstrap(1)
+    stub_api.routes['/api/entry/1/history'] = {
+        'current': [history_row(1, 60, 60)], 'chips': []}
+    store = HistoryStore(archive=GameweekArchive(str(tmp_path / 'archive.sqlite3')))
+
+    assert len(store.get(1)['current']) == 1
+
+    stub_api.routes['/api/bootstrap-static/'] = bootstrap(2, settled=False)
+    stub_api.routes['/api/entry/1/history'] = {
+        'current': [history_row(1, 60, 60), history_row(2, 40, 100)], 'chips': []}
+    extract.BOOTSTRAP_CACHE.clear()
+
+    assert len(store.get(1)['current']) == 2
+
+
+def test_is_valid_code_rejects_unknown_league(stub_api):
+    """Tests a league code the API doesn't recognise is invalid."""
+    stub_api.routes['/api/leagues-classic/1/standings'] = {
+        'league': {}, 'standings': {'has_next': False, 'page': 1, 'results': []}}
+
+    assert is_valid_code(1)
+    assert not is_valid_code(2)
+
+
+def test_picks_store_keeps_completed_documents_on_failure(stub_api):
+    """Tests documents fetched before a failure aren't fetched again."""
+    stub_api.routes['/api/entry/1/event/1/picks'] = {'picks': []}
+    store = PicksStore()
+
+    with pytest.raises(RequestException):
+        store.get_many([(1, 1), (1, 2)])
+
+    stub_api.routes['/api/entry/1/event/2/picks'] = {'picks': []}
+    store.get_many([(1, 1), (1, 2)])
+
+    assert stub_api.paths.count('/api/entry/1/event/1/picks') == 1
+
+
+def test_picks_store_reads_finished_gameweeks_from_archive(stub_api, tmp_path):
+    """Tests finished gameweeks are only downloaded once across refreshes."""
+    stub_api.routes['/api/bootstrap-static/'] = {
+        'events': [{'id': 1, 'deadline_time': '2024-08-16T17:30:00Z',
+                    'is_current': False, 'finished': True, 'data_checked': True},
+                   {'id': 2, 'deadline_time': '2024-08-24T10:00:00Z',
+                    'is_current': True, 'finished': False, 'data_checked': False}],
+        'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130}],
+        **BOOTSTRAP_LOOKUPS}
+    for gw in (1, 2):
+        stub_api.routes[f'/api/entry/1/event/{gw}/picks'] = {'picks': [gw]}
+    archive = GameweekArchive(str(tmp_path / 'archive.sqlite3'))
+
+    PicksStore(archive=archive).get_many([(1, 1), (1, 2)])
+    store = PicksStore(archive=archive)
+    picks = store.get_many([(1, 1), (1, 2)])
+    archive.close()
+
+    assert [document['picks'] for document in picks] == [[1], [2]]
+    assert stub_api.paths.count('/api/entry/1/event/1/picks') == 1
+    assert stub_api.paths.count('/api/entry/1/event/2/picks') == 2
+    assert store.stats()['archived'] == 1
+
+
+def test_document_store_evicts_least_recently_used(stub_api):
+    """Tests the store keeps at most max_documents documents."""
+    for gw in (1, 2, 3):
+        stub_api.routes[f'/api/entry/1/event/{gw}/picks'] = {'picks': []}
+    store = PicksStore()
+    store.max_documents = 2
+
+    store.get_many([(1, 1), (1, 2)])
+    store.get(1, 1)
+    store.get(1, 3)
+    store.get_many([(1, 1), (1, 2)])
+
+    assert stub_api.paths.count('/api/entry/1/event/1/picks') == 1
+    assert stub_api.paths.count('/api/entry/1/event/2/picks') == 2
+
+
+def test_archive_keeps_seasons_apart(tmp_path):
+    """Tests documents saved in one season aren't loaded in the next."""
+    archive = GameweekArchive(str(tmp_path / 'archive.sqlite3'))
+
+    archive.save_many(2024, 'live', {(0, 1): {'elements': [1]}})
+    archive.save_many(2025, 'live', {(0, 2): {'elements': [2]}})
+
+    assert archive.load_many(2024, 'live', [(0, 1)]) == {(0, 1): {'elements': [1]}}
+    assert archive.load_many(2025, 'live', [(0, 1), (0, 2)]) == {
+        (0, 2): {'elements': [2]}}
+    archive.close()
+
+
+def test_document_store_refreshes_unsettled_gameweeks(stub_api):
+    """Tests documents for an unfinished gameweek are downloaded again."""
+    stub_api.routes['/api/event/5/live'] = {'elements': []}
+    now = [0.0]
+    store = LivePointsStore(clock=lambda: now[0])
+
+    store.get(5)
+    store.get(5)
+    now[0] = UNSETTLED_RECHECK + 1
+    store.get(5)
+
+    assert len(stub_api.paths) == 2
+
+
+def standings_page(page: int, entries: range, has_next: bool) -> dict:
+    """Returns a standings page in the shape the API serves it."""
+    return {'league': {'name': 'big league'},
+            'standings': {'has_next': has_next, 'page': page,
+                          'results': [{'entry': entry} for entry in entries]}}
+
+
+def test_raw_league_data_merges_every_page(stub_api):
+    """Tests every standings page is fetched and merged in order."""
+    url = '/api/leagues-classic/1/standings'
+    stub_api.routes[url] = standings_page(1, range(0, 50), True)
+    stub_api.routes[f'{url}?page_standings=2'] = standings_page(
+        2, range(50, 100), True)
+    stub_api.routes[f'{url}?page_standings=3'] = standings_page(
+        3, range(100, 120), False)
+    stub_api.routes[f'{url}?page_standings=4'] = standings_page(4, range(0), False)
+
+    league_data = get_raw_league_data(1)
+
+    assert [result['entry'] for result in league_data['standings']['results']] \
+        == list(range(120))
+    assert len(stub_api.paths) == 4
+    assert league_data['league'] == {'name': 'big league'}
+    assert not league_data['standings']['has_next']
+
+
+def test_select_managers_caps_league():
+    """Tests large leagues are cut to the top or a stable sample."""
+    league_data = standings_page(1, range(10), False)
+
+    top = select_managers(league_data, 3, 'top')
+    sample = select_managers(league_data, 3, 'sample')
+    entries = [result['entry'] for result in sample['standings']['results']]
+
+    assert [result['entry'] for result in top['standings']['results']] == [0, 1, 2]
+    assert len(entries) == 3 and entries == sorted(entries)
+    assert select_managers(league_data, 3, 'sample') == sample
+    assert select_managers(league_data, None) is league_data
+    with pytest.raises(ValueError):
+        select_managers(league_data, 3, 'worst')
+
+
+def test_large_leagues_are_spilled_to_parquet(stub_api, monkeypatch, tmp_path):
+    """Tests leagues over the out-of-core limit give the same analytics."""
+    stub_api.routes['/api/bootstrap-static/'] = {
+        'events': [{'id': 2, 'deadline_time': '2024-08-16T17:30:00Z',
+                    'is_current': True, 'finished': True, 'data_checked': True}],
+        'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130}],
+        **BOOTSTRAP_LOOKUPS}
+    for manager_id in (1, 2, 3):
+        stub_api.routes[f'/api/entry/{manager_id}/history'] = {
+            'current': [history_row(1, 10 * manager_id, 10 * manager_id),
+                        history_row(2, 20, 10 * manager_id + 20)],
+            'chips': [{'name': 'bboost', 'event': manager_id}]}
+        for gw in (1, 2):
+            stub_api.routes[f'/api/entry/{manager_id}/event/{gw}/picks'] = {
+                'picks': [{'element': 5, 'is_captain': True,
+                           'multiplier': 2}]}
+    for gw in (1, 2):
+        stub_api.routes[f'/api/event/{gw}/live'] = {
+            'elements': [{'id': 5, 'stats': {'total_points': gw * 4}}]}
+
+    in_memory = [get_points_average_data(MANAGER_DATA),
+                 get_league_chip_data(MANAGER_DATA),
+                 get_league_captain_picks(MANAGER_DATA).sort(
+                     'manager_id', 'gameweek')]
+
+    monkeypatch.setattr(extract, 'SPILL', ParquetSpill(str(tmp_path)))
+    monkeypatch.setattr(extract, 'OUT_OF_CORE_MANAGERS', 2)
+    monkeypatch.setattr(extract, 'INGEST_BATCH_SIZE', 2)
+
+    spilled = [get_points_average_data(MANAGER_DATA),
+               get_league_chip_data(MANAGER_DATA),
+               get_league_captain_picks(MANAGER_DATA).sort(
+                   'manager_id', 'gameweek')]
+
+    assert all(frame.equals(expected)
+               for frame, expected in zip(spilled, in_memory))
+    assert len(list(tmp_path.glob('*/v-*/history/*.parquet'))) == 2
+
+
+def test_rankings_fill_in_overall_ranks(stub_api):
+    """Tests the summary table gets each manager's overall rank."""
+    league_data = standings_page(1, range(1, 3), False)
+    for position, result in enumerate(league_data['standings']['results'], 1):
+        result.update({'rank': position, 'player_name': str(position),
+                       'entry_name': '', 'total': 100, 'event_total': 50})
+        stub_api.routes[f"/api/entry/{result['entry']}"] = {
+            'summary_overall_rank': 1000 * position}
+
+    rankings = get_rankings(league_data)
+
+    assert rankings['Overall Rank'].to_list() == [1000, 2000]
+    assert rankings['Manager'].to_list() == ['1', '2']
+
+
+def test_league_captain_picks_join_scores_and_names(stub_api):
+    """Tests captains are matched to their names and multiplied scores."""
+    stub_api.routes['/api/bootstrap-static/'] = {
+        'events': [{'id': 2, 'deadline_time': '2024-08-16T17:30:00Z',
+                    'is_current': True, 'finished': True, 'data_checked': True}],
+        'elements': [{'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130},
+                     {'id': 9, 'web_name': 'Haaland', 'team': 13,
+                      'element_type': 4, 'now_cost': 150}],
+        **BOOTSTRAP_LOOKUPS}
+    stub_api.routes['/api/entry/1/event/1/picks'] = {'picks': [
+        {'element': 5, 'is_captain': True, 'multiplier': 2},
+        {'element': 9, 'is_captain': False, 'multiplier': 1}]}
+    stub_api.routes['/api/entry/1/event/2/picks'] = {'picks': [
+        {'element': 5, 'is_captain': False, 'multiplier': 1},
+        {'element': 9, 'is_captain': True, 'multiplier': 3}]}
+    for gw in (1, 2):
+        stub_api.routes[f'/api/event/{gw}/live'] = {'elements': [
+            {'id': 5, 'stats': {'total_points': 6}},
+            {'id': 9, 'stats': {'total_points': 13}}]}
+
+    captains = get_league_captain_picks(MANAGER_DATA.head(1)).sort('gameweek')
+
+    assert captains['web_name'].to_list() == ['Salah', 'Haaland']
+    assert captains['player_score'].to_list() == [6, 13]
+    assert captains['captain_points'].to_list() == [12, 39]
+    assert captains['team'].to_list() == ['LIV', 'MCI']
+    assert captains['player_name'].to_list() == ['A', 'A']
+    assert len(stub_api.paths) == 5
+
+
+def test_player_index_resolves_ids_in_bulk():
+    """Tests a column of IDs is resolved in order, with unknown IDs left null."""
+    index = PlayerIndex.from_bootstrap({
+        'elements': [{'id': 9, 'web_name': 'Haaland', 'team': 13,
+                      'element_type': 4, 'now_cost': 150},
+                     {'id': 5, 'web_name': 'Salah', 'team': 12,
+                      'element_type': 3, 'now_cost': 130}],
+        **BOOTSTRAP_LOOKUPS})
+
+    players = index.resolve([5, 7, 9, 5])
+    picks = index.enrich(pl.DataFrame({'element': [9, 5]}).lazy(), on='element',
+                         columns=['position'])
+
+    assert players['web_name'].to_list() == ['Salah', None, 'Haaland', 'Salah']
+    assert players['team'].to_list() == ['LIV', None, 'MCI', 'LIV']
+    assert players['price'].to_list() == [13.0, None, 15.0, 13.0]
+    assert picks.collect().to_dicts() == [{'element': 9, 'position': 'FWD'},
+                                          {'element': 5, 'position': 'MID'}]
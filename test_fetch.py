@@ -0,0 +1,167 @@
+"""Unit tests for the fetch engine."""
+
+import pytest
+from requests.exceptions import RequestException
+
+import fetch
+from fetch import (APIUnavailableError, CircuitBreaker, CircuitOpenError,
+                   FetchEngine, TokenBucket, parse_retry_after)
+
+
+@pytest.fixture(name='engine')
+def fixture_engine(request):
+    """Returns a fetch engine with a small concurrency limit.
+
+    Tests can pass other engine arguments with indirect parametrization.
+    """
+    options = getattr(request, 'param', {'max_concurrency': 3})
+    fetch_engine = FetchEngine(**options)
+    yield fetch_engine
+    fetch_engine.close()
+
+
+def test_fetch_many_keeps_order(stub_api, engine):
+    """Tests documents are returned in the order they were requested."""
+    for i in range(10):
+        stub_api.routes[f'/api/entry/{i}'] = {'id': i}
+
+    documents = engine.fetch_many(
+        [f'{stub_api.base_url}/entry/{i}' for i in range(10)])
+
+    assert [document['id'] for document in documents] == list(range(10))
+
+
+def test_fetch_as_completed_yields_every_position(stub_api, engine):
+    """Tests each document is yielded once with its position, failures included."""
+    for i in range(5):
+        stub_api.routes[f'/api/entry/{i}'] = {'id': i}
+
+    results = dict(engine.fetch_as_completed(
+        [f'{stub_api.base_url}/entry/{i}' for i in range(6)]))
+
+    assert {index: results[index]['id'] for index in range(5)} == {
+        i: i for i in range(5)}
+    assert isinstance(results[5], RequestException)
+
+
+def test_fetch_many_respects_concurrency_limit(stub_api, engine):
+    """Tests the number of requests in flight never exceeds the limit."""
+    stub_api.delay = 0.05
+    for i in range(12):
+        stub_api.routes[f'/api/entry/{i}'] = {'id': i}
+
+    engine.fetch_many([f'{stub_api.base_url}/entry/{i}' for i in range(12)])
+
+    assert stub_api.max_in_flight == 3
+
+
+def test_fetch_raises_for_error_status(stub_api, engine):
+    """Tests a non-200 response raises a request exception."""
+    with pytest.raises(RequestException):
+        engine.fetch(f'{stub_api.base_url}/entry/404')
+
+
+def test_fetch_retries_throttled_request(stub_api, engine):
+    """Tests a 429 is retried after the Retry-After delay."""
+    stub_api.routes['/api/entry/1'] = {'id': 1}
+    stub_api.failures['/api/entry/1'] = [429, 429]
+
+    assert engine.fetch(f'{stub_api.base_url}/entry/1') == {'id': 1}
+    assert len(stub_api.paths) == 3
+
+
+@pytest.mark.parametrize('engine', [{'retry_budget': 1}], indirect=True)
+def test_fetch_stops_when_retry_budget_is_spent(stub_api, engine, monkeypatch):
+    """Tests retries stop once the shared retry budget runs out."""
+    monkeypatch.setattr(fetch, 'BACKOFF_BASE', 0.001)
+    stub_api.routes['/api/entry/1'] = {'id': 1}
+    stub_api.failures['/api/entry/1'] = [503, 503, 503]
+
+    with pytest.raises(RequestException):
+        engine.fetch(f'{stub_api.base_url}/entry/1')
+
+    assert len(stub_api.paths) == 2
+
+
+@pytest.mark.parametrize('engine', [{'retry_budget': 1}], indirect=True)
+def test_retry_budget_is_per_batch(stub_api, engine, monkeypatch):
+    """Tests a spent budget doesn't stop retries in the next batch."""
+    monkeypatch.setattr(fetch, 'BACKOFF_BASE', 0.001)
+    stub_api.routes['/api/entry/1'] = {'id': 1}
+    stub_api.failures['/api/entry/1'] = [503, 503, 503]
+
+    with pytest.raises(RequestException):
+        engine.fetch(f'{stub_api.base_url}/entry/1')
+
+    assert engine.fetch(f'{stub_api.base_url}/entry/1') == {'id': 1}
+
+
+def test_fetch_fails_fast_on_long_retry_after(stub_api, engine, monkeypatch):
+    """Tests a Retry-After beyond the backoff cap isn't waited for."""
+    monkeypatch.setattr(fetch, 'BACKOFF_CAP', 0.5)
+    monkeypatch.setattr(fetch, 'parse_retry_after', lambda value: 3600.0)
+    stub_api.routes['/api/entry/1'] = {'id': 1}
+    stub_api.failures['/api/entry/1'] = [503]
+
+    with pytest.raises(RequestException):
+        engine.fetch(f'{stub_api.base_url}/entry/1')
+
+    assert engine.bucket.reserve() == 0
+    assert len(stub_api.paths) == 1
+
+
+def test_open_circuit_refuses_requests(stub_api, engine, monkeypatch):
+    """Tests requests fail without being sent once enough have failed in a row."""
+    monkeypatch.setattr(fetch, 'BACKOFF_BASE', 0.001)
+    engine.breaker = CircuitBreaker(threshold=2)
+    stub_api.routes['/api/entry/1'] = {'id': 1}
+    stub_api.failures['/api/entry/1'] = [503] * 10
+
+    with pytest.raises(APIUnavailableError):
+        engine.fetch(f'{stub_api.base_url}/entry/1')
+    with pytest.raises(CircuitOpenError):
+        engine.fetch(f'{stub_api.base_url}/entry/1')
+
+    assert len(stub_api.paths) == 2
+    assert engine.breaker.state == 'open'
+
+
+def test_circuit_breaker_lets_one_trial_through_after_reset():
+    """Tests a half open circuit allows one request, closing if it succeeds."""
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30, clock=lambda: now[0])
+    breaker.record_failure()
+
+    assert not breaker.allow()
+    now[0] = 30.0
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    now[0] = 60.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_token_bucket_paces_requests():
+    """Tests the bucket allows a burst and then refills at its rate."""
+    now = [0.0]
+    bucket = TokenBucket(rate=10, capacity=2, clock=lambda: now[0])
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+
+    now[0] = 0.1
+    assert bucket.reserve() == 0
+
+
+def test_parse_retry_after_accepts_seconds():
+    """Tests a numeric Retry-After header is read as seconds."""
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
@@ -0,0 +1,124 @@
+"""Unit tests for live gameweek scoring."""
+
+import polars as pl
+import pytest
+
+import extract
+from extract import get_manager_data, get_raw_league_data
+from live import LiveLeague, LivePointsPoller, score_league
+
+
+POSITIONS = ['GKP', 'DEF', 'DEF', 'DEF', 'MID', 'MID', 'MID', 'MID',
+             'FWD', 'FWD', 'FWD', 'GKP', 'MID', 'DEF', 'FWD']
+
+
+def make_picks(manager_id: int, captain: int, vice_captain: int,
+               bench_multiplier: int = 0) -> list[dict]:
+    """Returns a squad of players 1 to 15 picked in order."""
+    return [{'manager_id': manager_id, 'slot': slot, 'id': slot,
+             'multiplier': (2 if slot == captain else 1) if slot <= 11 else bench_multiplier,
+             'is_captain': slot == captain, 'is_vice_captain': slot == vice_captain,
+             'web_name': f'Player {slot}', 'position': position, 'team_id': 1}
+            for slot, position in enumerate(POSITIONS, 1)]
+
+
+def test_score_league_substitutes_players_who_did_not_play():
+    """Tests auto-subs keep a valid formation and the vice captain takes over."""
+    picks = pl.DataFrame(make_picks(1, captain=9, vice_captain=10)
+                         + make_picks(2, captain=3, vice_captain=4, bench_multiplier=1))
+    entries = pl.DataFrame({'manager_id': [1, 2], 'chip': [None, 'bboost'],
+                            'previous_total': [100, 90], 'transfer_cost': [4, 0]})
+    not_played = {1, 2, 9}
+    live = pl.DataFrame({'id': range(1, 16),
+                         'points': [0 if player in not_played else player
+                                    for player in range(1, 16)],
+                         'minutes': [0 if player in not_played else 90
+                                     for player in range(1, 16)]})
+    fixtures = pl.DataFrame({'team_id': [1], 'finishes_at': [0.0]})
+    manager_data = pl.DataFrame({'manager_id': [1, 2], 'player_name': ['Ann', 'Bob'],
+                                 'entry_name': ['Team A', 'Team B']})
+
+    table = score_league(picks, entries, live, fixtures, manager_data, now=1.0)
+
+    # Ann's goalkeeper, a defender and the captain, a forward, didn't play. The
+    # midfielder first on the bench can't replace the defender without leaving
+    # two, so replaces the forward, and the vice captain gets the armband.
+    assert table.to_dicts() == [
+        {'Rank': 1, 'Change': 1, 'Manager': 'Bob', 'Team Name': 'Team B',
+         'Live Points': 111, 'Total Points': 201, 'Captain': 'Player 3',
+         'Captain Points': 6, 'Auto Subs': 0},
+        {'Rank': 2, 'Change': -1, 'Manager': 'Ann', 'Team Name': 'Team A',
+         'Live Points': 99, 'Total Points': 199, 'Captain': 'Player 10',
+         'Captain Points': 20, 'Auto Subs': 3}]
+
+
+def test_score_league_waits_for_fixtures_to_finish():
+    """Tests nobody is substituted until their team's fixtures have finished."""
+    picks = pl.DataFrame(make_picks(1, captain=9, vice_captain=10))
+    entries = pl.DataFrame({'manager_id': [1], 'chip': [None],
+                            'previous_total': [0], 'transfer_cost': [0]})
+    live = pl.DataFrame({'id': range(1, 16), 'points': [0] * 15, 'minutes': [0] * 15})
+    fixtures = pl.DataFrame({'team_id': [1], 'finishes_at': [10.0]})
+    manager_data = pl.DataFrame({'manager_id': [1], 'player_name': ['Ann'],
+                                 'entry_name': ['Team A']})
+
+    table = score_league(picks, entries, live, fixtures, manager_data, now=5.0)
+
+    assert table['Auto Subs'].to_list() == [0]
+    assert table['Captain'].to_list() == ['Player 9']
+
+
+# A league part way through its last gameweek.
+LIVE_LEAGUE = pytest.mark.parametrize(
+    'mock_api', [{'managers': 20, 'gameweeks': 3, 'live': True}], indirect=True)
+
+
+@LIVE_LEAGUE
+def test_live_league_polls_one_document(mock_api, monkeypatch):
+    """Tests each refresh is one conditional request for the live document."""
+    documents = []
+    fetch_if_modified = extract.ENGINE.fetch_if_modified
+
+    def record(*args):
+        result = fetch_if_modified(*args)
+        documents.append(result[0])
+        return result
+
+    monkeypatch.setattr(extract.ENGINE, 'fetch_if_modified', record)
+
+    manager_data = get_manager_data(get_raw_league_data(1))
+    league = LiveLeague(manager_data, 3, LivePointsPoller(interval=0))
+
+    requests = mock_api.requests
+    table = league.refresh()
+    assert mock_api.requests - requests == 1
+    assert table.height == 20
+    assert league.estimated_size() > league.picks.estimated_size()
+    assert table['Total Points'].to_list() == sorted(table['Total Points'], reverse=True)
+
+    requests = mock_api.requests
+    assert league.refresh() is table
+    assert mock_api.requests - requests == 1
+    assert documents[-1] is None
+
+    mock_api.league.update_live_points(changes=50)
+
+    requests = mock_api.requests
+    updated = league.refresh()
+    assert mock_api.requests - requests == 1
+    assert documents[-1] is not None
+    assert updated['Live Points'].sum() > table['Live Points'].sum()
+
+
+@LIVE_LEAGUE
+def test_poller_shares_documents_within_the_interval(mock_api):
+    """Tests sessions polling within the interval share one request."""
+    poller = LivePointsPoller(interval=60.0)
+
+    requests = mock_api.requests
+    live, version = poller.poll(3)
+
+    assert poller.poll(3)[0] is live
+    assert poller.poll(3)[1] == version
+    assert mock_api.requests - requests == 1
+    assert live.columns == ['id', 'points', 'minutes']
@@ -0,0 +1,15 @@
+"""Unit tests for the dashboard load test."""
+
+from benchmark import patch_api
+from loadtest import MockAPIProcess, run_step
+
+
+def test_concurrent_sessions_render():
+    """Tests concurrent sessions each render the dashboard against the mock API."""
+    with MockAPIProcess(10, 3) as server, patch_api(server.base_url):
+        result = run_step(2, server, timeout=60)
+
+    assert result['failed'] == 0
+    assert result['p50_seconds'] <= result['max_seconds'] <= result['wall_seconds']
+    assert result['requests'] > 0
+    assert result['peak_memory_mb'] > 0
@@ -0,0 +1,78 @@
+"""Unit tests for the mock FPL API."""
+
+from threading import Thread
+
+import pytest
+
+import extract
+from extract import get_raw_league_data, get_league_captain_picks, get_manager_data
+from fetch import FetchEngine
+from fixtures import FixtureStore, get_fixture_name
+from mock_api import MockFPLServer, SyntheticLeague
+
+
+def start(server: MockFPLServer) -> MockFPLServer:
+    """Serves requests in the background until the server is shut down."""
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return server
+
+
+def test_synthetic_league_is_consistent(mock_api):
+    """Tests the standings agree with every manager's own history."""
+    league_data = get_raw_league_data(1)
+    results = league_data['standings']['results']
+    histories = extract.get_league_histories([result['entry'] for result in results])
+
+    assert len(results) == 120
+    assert [result['total'] for result in results] == sorted(
+        (result['total'] for result in results), reverse=True)
+    assert all(result['total'] == history['current'][-1]['total_points']
+               for result, history in zip(results, histories))
+    assert mock_api.league.history(7) == SyntheticLeague(120, 3).history(7)
+
+
+def test_captain_picks_cover_every_gameweek(mock_api):
+    """Tests the captain stage runs end to end against the mock API."""
+    manager_data = get_manager_data(get_raw_league_data(1)).head(10)
+
+    captains = get_league_captain_picks(manager_data)
+
+    assert len(captains) == 30
+    assert captains['web_name'].null_count() == 0
+    # Three standings pages: the first, then batches of one and two pages.
+    assert mock_api.requests == 1 + 1 + 2 + 1 + 10 * 3 + 3
+
+
+def test_injected_errors_are_retried(mock_api):
+    """Tests the fetch engine gets through a share of failing requests."""
+    mock_api.error_rate = 0.3
+    engine = FetchEngine()
+
+    try:
+        documents = engine.fetch_many(
+            [f'{mock_api.base_url}/entry/{i}/history' for i in range(1, 21)])
+    finally:
+        engine.close()
+
+    assert len(documents) == 20
+    assert mock_api.requests > 20
+
+
+def test_recorded_responses_are_replayed(mock_api, tmp_path):
+    """Tests responses recorded by the fetch engine are served back verbatim."""
+    engine = FetchEngine(recorder=FixtureStore(str(tmp_path)))
+    url = f'{mock_api.base_url}/leagues-classic/1/standings?page_standings=2'
+
+    try:
+        recorded = engine.fetch(url)
+        replay = start(MockFPLServer(fixtures=FixtureStore(str(tmp_path))))
+        replayed = engine.fetch(url.replace(mock_api.base_url, replay.base_url))
+        with pytest.raises(extract.RequestException):
+            engine.fetch(f'{replay.base_url}/bootstrap-static/')
+    finally:
+        engine.close()
+        replay.shutdown()
+        replay.server_close()
+
+    assert replayed == recorded
+    assert (tmp_path / get_fixture_name(url)).exists()
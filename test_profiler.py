@@ -0,0 +1,29 @@
+"""Unit tests for the tab profiling hooks."""
+
+import pstats
+import tracemalloc
+
+import polars as pl
+
+from profiler import profile_section
+
+
+def build_frame() -> pl.DataFrame:
+    """Builds a frame so the profile has a function and allocations to show."""
+    return pl.DataFrame({'points': [[gw] * 100 for gw in range(1000)]})
+
+
+def test_profile_section_saves_reports(tmp_path):
+    """Tests a profiled block saves a pstats file and a named text report."""
+    with profile_section(str(tmp_path), 'captains', 'load', 50, 12) as name:
+        build_frame()
+
+    report = (tmp_path / f"{name}.txt").read_text()
+
+    assert name.endswith('-captains-load-50managers-gw12')
+    assert 'Managers: 50' in report and 'Gameweek: 12' in report
+    assert 'build_frame' in report
+    assert 'Largest allocations by line' in report
+    assert any('build_frame' in function[2]
+               for function in pstats.Stats(f"{name}.prof").stats)
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,99 @@
+"""Unit tests for the Parquet spill."""
+
+import polars as pl
+
+from spill import MAX_DATASET_AGE, SUPERSEDED_RETENTION, ParquetSpill
+
+
+SCHEMAS = {'points': {'id': pl.Int64, 'points': pl.Int64},
+           'chips': {'id': pl.Int64, 'chip': pl.String}}
+
+
+def test_scan_writes_dataset_once(tmp_path):
+    """Tests every batch is written and the dataset is then reused."""
+    spill = ParquetSpill(str(tmp_path))
+    calls = []
+
+    def batches():
+        calls.append(1)
+        for start in (0, 2):
+            yield {'points': pl.DataFrame(
+                {'id': [start, start + 1], 'points': [10, 20]})}
+
+    first = spill.scan(('league', 1), 'points', batches, SCHEMAS).collect()
+    second = spill.scan(('league', 1), 'points', batches, SCHEMAS).collect()
+
+    assert first['id'].to_list() == [0, 1, 2, 3]
+    assert second.equals(first)
+    assert len(calls) == 1
+
+
+def test_scan_writes_empty_tables(tmp_path):
+    """Tests a table with no rows in any batch can still be scanned."""
+    spill = ParquetSpill(str(tmp_path))
+
+    chips = spill.scan(('league', 1), 'chips', lambda: [], SCHEMAS).collect()
+
+    assert chips.is_empty()
+    assert chips.schema == pl.Schema(SCHEMAS['chips'])
+
+
+def test_scan_rewrites_expired_dataset(tmp_path):
+    """Tests a dataset older than its ttl is written again."""
+    now = [0.0]
+    spill = ParquetSpill(str(tmp_path), clock=lambda: now[0])
+    points = [1]
+
+    def batches():
+        yield {'points': pl.DataFrame({'id': [1], 'points': points})}
+
+    spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60).collect()
+    points[0] = 5
+    now[0] = 1e12
+
+    rescanned = spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60)
+
+    assert rescanned.collect()['points'].to_list() == [5]
+
+
+def test_rewrite_keeps_scans_of_the_old_version_readable(tmp_path):
+    """Tests a scan taken before a dataset is rewritten can still be collected."""
+    now = [0.0]
+    spill = ParquetSpill(str(tmp_path), clock=lambda: now[0])
+    points = [1]
+
+    def batches():
+        yield {'points': pl.DataFrame({'id': [1], 'points': points})}
+
+    old = spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60)
+    points[0] = 5
+    now[0] = 61.0
+    new = spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60)
+
+    assert old.collect()['points'].to_list() == [1]
+    assert new.collect()['points'].to_list() == [5]
+
+
+def test_prune_deletes_replaced_versions_and_unused_datasets(tmp_path):
+    """Tests old versions and datasets nobody uses are deleted after their retention."""
+    now = [0.0]
+    spill = ParquetSpill(str(tmp_path), clock=lambda: now[0])
+
+    def batches():
+        yield {'points': pl.DataFrame({'id': [1], 'points': [1]})}
+
+    spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60)
+    spill.scan(('league', 2), 'points', batches, SCHEMAS)
+    now[0] = 61.0
+    spill.scan(('league', 1), 'points', batches, SCHEMAS, ttl=60)
+
+    now[0] = 62.0 + SUPERSEDED_RETENTION
+    spill.prune()
+
+    assert len(list(tmp_path.glob('*/v-*'))) == 2
+
+    now[0] = 62.0 + MAX_DATASET_AGE
+    spill.scan(('league', 1), 'points', batches, SCHEMAS)
+    spill.prune()
+
+    assert len(list(tmp_path.glob('*'))) == 1
@@ -0,0 +1,62 @@
+"""Unit tests for the request telemetry."""
+
+from fetch import FetchEngine
+from telemetry import Telemetry, get_endpoint, get_percentile, tab_context
+
+
+def test_get_endpoint_replaces_ids():
+    """Tests URLs for different managers share an endpoint template."""
+    assert get_endpoint('https://x/api/entry/123/event/4/picks') == \
+        '/api/entry/{id}/event/{id}/picks'
+    assert get_endpoint('https://x/api/leagues-classic/9/standings?page_standings=2') \
+        == '/api/leagues-classic/{id}/standings'
+
+
+def test_get_percentile_uses_nearest_rank():
+    """Tests percentiles are picked from the recorded samples."""
+    samples = [float(i) for i in range(1, 101)]
+
+    assert get_percentile(samples, 0.5) == 50.0
+    assert get_percentile(samples, 0.99) == 99.0
+    assert get_percentile([], 0.5) is None
+
+
+def test_requests_are_grouped_by_tab(stub_api):
+    """Tests each attempt is recorded against the tab that made it."""
+    stub_api.routes['/api/entry/1/history'] = {'current': []}
+    stub_api.routes['/api/entry/2/history'] = {'current': []}
+    stub_api.failures['/api/entry/2/history'] = [429]
+    telemetry = Telemetry()
+    engine = FetchEngine(telemetry=telemetry)
+
+    try:
+        with tab_context('chips'):
+            engine.fetch_many([f'{stub_api.base_url}/entry/{i}/history'
+                               for i in (1, 2)])
+        engine.fetch(f'{stub_api.base_url}/entry/1/history')
+    finally:
+        engine.close()
+
+    rows = {row['tab']: row for row in telemetry.snapshot()}
+
+    assert rows['chips']['endpoint'] == '/api/entry/{id}/history'
+    assert rows['chips']['requests'] == 3
+    assert rows['chips']['retries'] == 1
+    assert rows['chips']['throttled'] == 1
+    assert rows['chips']['bytes'] == 3 * len('{"current": []}')
+    assert rows['other']['requests'] == 1
+
+
+def test_exports_are_structured():
+    """Tests the statistics export as JSON lines and Prometheus metrics."""
+    telemetry = Telemetry(clock=lambda: 100.0)
+    telemetry.record_request('https://x/api/event/3/live', 200, 0.25, 10,
+                             tab='captains')
+    telemetry.record_cache('https://x/api/event/3/live', 4, 1)
+
+    assert telemetry.to_json_lines().count('\n') == 2
+    assert 'fpl_api_requests_total{tab="captains",endpoint="/api/event/{id}/live"} 1' \
+        in telemetry.to_prometheus()
+    assert 'fpl_api_cache_hits_total{tab="other",endpoint="/api/event/{id}/live"} 4' \
+        in telemetry.to_prometheus()
+    assert 'quantile="0.5"} 0.25' in telemetry.to_prometheus()
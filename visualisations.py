@@ -45,6 +45,7 @@ def get_manager_captains_chart(manager: str, captain_picks: pl.DataFrame) -> alt
         y=alt.Y('player_score:Q', title="Captain Score"),
         color=alt.Color('web_name:N', title='Player'),
         tooltip=[alt.Tooltip('web_name', title='Player'),
+                 alt.Tooltip('team', title='Team'),
                  alt.Tooltip('player_score', title='Score')]
     ).properties(height=500)
 